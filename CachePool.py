@@ -0,0 +1,197 @@
+# coding: utf-8
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+
+def sizeof(value):
+    """A rough measure, in bytes, of the memory held by a cached value."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(v) for v in value)
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value.__dict__.values() if isinstance(v, np.ndarray))
+    return sys.getsizeof(value)
+
+
+class CachePool(object):
+    """A set of named caches sharing one memory budget. When the values held
+    by all the caches together come to more than `max_bytes`, the least
+    recently used values (from whichever cache) are evicted. With `max_bytes`
+    of `None`, nothing is evicted, but sizes and statistics are still kept.
+
+    A value bigger than `max_fraction` of the budget isn't kept at all (it is
+    counted as rejected), as making room for it would flush everything else.
+
+    To use another caching policy, pass an object with the same `cache(name)`,
+    `stats()` and `bytes` interface to `CounterSpace`."""
+
+    def __init__(self, max_bytes = None, max_fraction = 0.25):
+        self.max_bytes = max_bytes
+        self.max_fraction = max_fraction
+        self.bytes = 0
+        self.caches = OrderedDict()
+        self._entries = OrderedDict()
+
+    @property
+    def max_value_bytes(self):
+        """The size of the biggest value the pool will keep, or `None` if there is no limit."""
+        if self.max_bytes is None:
+            return None
+        return self.max_bytes * self.max_fraction
+
+    def cache(self, name, max_entries = None):
+        """Returns the pool's cache of the given name, creating it if needed."""
+        if not name in self.caches:
+            self.caches[name] = LRUCache(self, name, max_entries)
+        return self.caches[name]
+
+    def _touch(self, key):
+        self._entries[key] = self._entries.pop(key)
+
+    def _store(self, key, value):
+        """Stores the value, returning whether it was small enough to be kept."""
+        if key in self._entries:
+            self._discard(key)
+        size = sizeof(value)
+        if self.max_bytes is not None and size > self.max_value_bytes:
+            self.caches[key[0]].rejections += 1
+            return False
+        self._entries[key] = (value, size)
+        self.bytes += size
+        if self.max_bytes is not None:
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict(next(iter(self._entries)))
+        return True
+
+    def _evict(self, key):
+        self._discard(key)
+        self.caches[key[0]].evictions += 1
+
+    def _discard(self, key):
+        value, size = self._entries.pop(key)
+        self.bytes -= size
+        self.caches[key[0]].keys.pop(key[1], None)
+
+    def stats(self):
+        """Returns a dictionary of statistics for each cache in the pool, along with
+        the total memory held (under `"bytes"`)."""
+        stats = dict((name, cache.stats()) for name, cache in self.caches.items())
+        stats["bytes"] = self.bytes
+        return stats
+
+    def namespace(self, prefix):
+        """Returns a view of the pool whose caches are named with `prefix`, so that
+        another spacer can share the pool's budget without sharing its caches."""
+        return CacheNamespace(self, prefix)
+
+
+class CacheNamespace(object):
+    """The caches of a `CachePool` whose names start with a prefix, with the same
+    interface as the pool. Values held here count against the whole pool's budget."""
+
+    def __init__(self, pool, prefix):
+        self.pool = pool
+        self.prefix = prefix
+
+    @property
+    def max_bytes(self):
+        return self.pool.max_bytes
+
+    @property
+    def max_value_bytes(self):
+        return self.pool.max_value_bytes
+
+    @property
+    def bytes(self):
+        return sum(cache.bytes for name, cache in self.pool.caches.items() if name.startswith(self.prefix))
+
+    def cache(self, name, max_entries = None):
+        return self.pool.cache(self.prefix + name, max_entries)
+
+    def namespace(self, prefix):
+        return CacheNamespace(self.pool, self.prefix + prefix)
+
+    def stats(self):
+        stats = dict((name[len(self.prefix):], cache.stats())
+            for name, cache in self.pool.caches.items() if name.startswith(self.prefix))
+        stats["bytes"] = self.bytes
+        return stats
+
+
+class LRUCache(object):
+    """One of a `CachePool`'s caches, which behaves like a dictionary. Testing
+    for a key with `in` counts as a hit or a miss; `max_entries` optionally
+    bounds the number of values this cache holds, as well as the pool's budget.
+    `keys` is kept in order of use, so the least recently used is the first."""
+
+    def __init__(self, pool, name, max_entries = None):
+        self.pool = pool
+        self.name = name
+        self.max_entries = max_entries
+        self.keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+
+    def __contains__(self, key):
+        if key in self.keys:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def __getitem__(self, key):
+        if not key in self.keys:
+            raise KeyError(key)
+        self.pool._touch((self.name, key))
+        self.keys[key] = self.keys.pop(key)
+        return self.pool._entries[(self.name, key)][0]
+
+    def get(self, key, default = None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __setitem__(self, key, value):
+        if self.max_entries is not None and not key in self.keys and len(self.keys) >= self.max_entries:
+            self.pool._evict((self.name, next(iter(self.keys))))
+        # Storing again under a key first discards the old value, which takes the key
+        # out of `keys`; so the key is only added once the value is stored
+        if self.pool._store((self.name, key), value):
+            self.keys[key] = True
+
+    def holds(self, key):
+        """Whether the key is cached, without counting a hit or a miss."""
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def items(self):
+        """Returns the cache's keys and values, without counting lookups or
+        changing how recently they were used."""
+        return [(key, self.pool._entries[(self.name, key)][0]) for key in self.keys]
+
+    def clear(self):
+        for key in list(self.keys):
+            self.pool._discard((self.name, key))
+
+    @property
+    def bytes(self):
+        return sum(self.pool._entries[(self.name, key)][1] for key in self.keys)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "hit_ratio": float(self.hits) / lookups if lookups else 0.0,
+            "entries": len(self.keys),
+            "bytes": self.bytes,
+        }
@@ -13,11 +13,246 @@ try:
     import GlyphsApp
     from tensorfontglyphs import Font,GlyphRendering
 except Exception as e:
-    from tensorfont import Font,GlyphRendering
+    try:
+        from tensorfont import Font,GlyphRendering
+    except ImportError:
+        from tensorfontheadless import Font,GlyphRendering
 
 import scipy
 import string
-from scipy.signal import convolve
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+import time
+from CachePool import CachePool
+from Instrumentation import NullInstrumentation
+from timeit import default_timer
+try:
+    from scipy.fft import rfft2, irfft2, next_fast_len
+except ImportError:
+    # scipy.fft is new in scipy 1.4; older installs (as inside Glyphs) use numpy's
+    from numpy.fft import rfft2, irfft2
+    def next_fast_len(target, real = True):
+        """The smallest product of 2s, 3s and 5s no less than `target`."""
+        best = 2 * target
+        p5 = 1
+        while p5 < best:
+            p35 = p5
+            while p35 < best:
+                n = p35
+                while n < target:
+                    n *= 2
+                best = min(best, n)
+                p35 *= 3
+            p5 *= 5
+        return best
+
+class LightTemplate(object):
+    """An oversized rotated gaussian, computed once for a given width, height
+    and rotation, from which the lights are cut. The integer part of a light's
+    centre picks the slice of the template; the fractional part is corrected
+    for with a separable factor, so the result is the same as evaluating the
+    gaussian directly on the box's coordinate grid (whose top-left pixel is at
+    `origin`). The template is nine boxes big, so it is only computed once a second
+    light is cut from it; the first light evaluates just the slice it needs, which
+    gives exactly the same values. If the whole template would come to more than
+    `max_bytes`, only slices are ever evaluated."""
+    def __init__(self, width_x, width_y, rotation, box_height, box_width, origin, max_bytes = None):
+        self.box_height = box_height
+        self.box_width = box_width
+        self.origin = origin
+        self.cos, self.sin = np.cos(rotation), np.sin(rotation)
+        rot = np.array([[self.cos, -self.sin], [self.sin, self.cos]])
+        self.A = rot.T.dot(np.diag([1/float(width_x)**2, 1/float(width_y)**2])).dot(rot)
+
+        # Lights can be centred up to half a box outside the box
+        self.margin_y = box_height - 1 + box_height // 2
+        self.margin_x = box_width - 1 + box_width // 2
+        self.template = None
+        self.cut = 0
+        size = (2*self.margin_y+1) * (2*self.margin_x+1) * np.dtype(float).itemsize
+        self.whole = max_bytes is None or size <= max_bytes
+
+    def _slices(self, rows, cols, height, width):
+        """A stack of the `height` x `width` blocks of the template whose top-left
+        corners are at each of `rows` and `cols`."""
+        if self.template is None and self.whole and (self.cut > 0 or len(rows) > 1):
+            self.template = self._evaluate(np.arange(2*self.margin_y+1), np.arange(2*self.margin_x+1))
+        self.cut += len(rows)
+        if self.template is not None:
+            blocks = np.empty((len(rows), height, width))
+            for i, (row, col) in enumerate(zip(rows, cols)):
+                blocks[i] = self.template[row:row+height, col:col+width]
+            return blocks
+        rows = rows[:,np.newaxis] + np.arange(height)
+        cols = cols[:,np.newaxis] + np.arange(width)
+        return self._evaluate(rows[:,:,np.newaxis], cols[:,np.newaxis,:])
+
+    def _evaluate(self, rows, cols):
+        dy, dx = rows - self.margin_y, cols - self.margin_x
+        if dy.ndim == 1:
+            dy, dx = dy[:,np.newaxis], dx[np.newaxis,:]
+        return np.exp(-(self.A[0,0]*dx*dx + 2*self.A[0,1]*dx*dy + self.A[1,1]*dy*dy)/2.)
+
+    def lights(self, center_x, center_y, window = None):
+        """Returns a stack of the lights centred at the given points (arrays of x and y),
+        in the same orientation as `CounterSpace.gaussian`, along with a mask of those
+        which could be cut from the template; the rest are left as zeros. If a `window`
+        of rows and columns `(top, bottom, left, right)` is given, only that part of the
+        box is returned. Each light comes out the same, whichever others it is cut with."""
+        c, s = self.cos, self.sin
+        center_x = self.box_width/2 - np.asarray(center_x, dtype=float)
+        center_y = self.box_height/2 - (self.box_height - np.asarray(center_y, dtype=float))
+        center_x = center_x * c - center_y * s
+        center_y = center_x * s + center_y * c
+        # Back into (unrotated) grid coordinates, relative to the top-left pixel
+        vx = c * center_x + s * center_y - self.origin[0]
+        vy = -s * center_x + c * center_y - self.origin[1]
+        kx, ky = np.round(vx).astype(int), np.round(vy).astype(int)
+        row, col = self.margin_y - ky, self.margin_x - kx
+        fx, fy = vx - kx, vy - ky
+        ax = self.A[0,0] * fx + self.A[0,1] * fy
+        ay = self.A[1,0] * fx + self.A[1,1] * fy
+        valid = ((row >= 0) & (col >= 0) & (row <= 2*self.margin_y+1-self.box_height) & (col <= 2*self.margin_x+1-self.box_width)
+            # Otherwise the correction would overflow
+            & (np.abs(ax) * self.margin_x + np.abs(ay) * self.margin_y <= 600))
+
+        top, bottom, left, right = window or (0, self.box_height, 0, self.box_width)
+        # The light is flipped left to right, so the window's columns are counted from the right
+        left, right = self.box_width - right, self.box_width - left
+        everywhere = np.all(valid)
+        if not everywhere:
+            kx, ky, row, col, fx, fy, ax, ay = [v[valid] for v in (kx, ky, row, col, fx, fy, ax, ay)]
+        ex = np.exp(ax[:,np.newaxis] * (np.arange(left, right) - kx[:,np.newaxis]))
+        ey = np.exp(ay[:,np.newaxis] * (np.arange(top, bottom) - ky[:,np.newaxis])) * np.exp(-(ax*fx + ay*fy)/2.)[:,np.newaxis]
+        lights = self._slices(row + top, col + left, bottom - top, right - left)
+        lights *= ey[:,:,np.newaxis]
+        lights *= ex[:,np.newaxis,:]
+        if not everywhere:
+            lights, cut = np.zeros((len(valid),) + lights.shape[1:]), lights
+            lights[valid] = cut
+        return np.flip(lights,axis=-1), valid
+        ex = np.exp(ax[:,np.newaxis] * (np.arange(left, right) - kx[:,np.newaxis]))
+        ey = np.exp(ay[:,np.newaxis] * (np.arange(top, bottom) - ky[:,np.newaxis])) * np.exp(-(ax*fx + ay*fy)/2.)[:,np.newaxis]
+        lights = self._slices(row + top, col + left, bottom - top, right - left)
+        lights *= ey[:,:,np.newaxis]
+        lights *= ex[:,np.newaxis,:]
+        return np.flip(lights,axis=-1), valid
+
+class EdgeProfile(object):
+    """The white space at one side ("left" or "right") of a glyph image prepared by
+    `CounterSpace.concavity_reduced`. The edge mask of the image shifted by any whole
+    number of pixels is a slice of a canvas three boxes wide, so it can be had without
+    shifting and masking the image again."""
+    def __init__(self, image, side):
+        image = np.asarray(image)
+        if image.dtype == np.bool_:
+            image = image.view(np.uint8)
+        self.side = side
+        self.width = image.shape[1]
+        if side == "right":
+            image = np.flip(image,axis=1)
+        # Work out the first ink on each row as mask_ink_to_edge does
+        ink = (1 - image) < 5/255.0
+        self.has_ink = ink.any(axis=1)
+        self.first_ink = np.argmax(ink, axis=1)
+        inked = self.first_ink[self.has_ink]
+        self.leftmost = np.min(inked) if len(inked) else 0
+        self.rightmost = np.max(inked) if len(inked) else 0
+
+        columns = np.arange(-self.width, 2*self.width)
+        canvas = (columns < (self.first_ink - 1)[:,np.newaxis]) & self.has_ink[:,np.newaxis]
+        canvas = canvas.astype(np.uint8)
+        if side == "right":
+            canvas = np.flip(canvas,axis=1)
+        canvas.flags.writeable = False
+        self.canvas = canvas
+
+    def shifted(self, amount):
+        """Returns the edge mask of the image shifted right by `amount` pixels, as a
+        read-only view, or `None` if that can't be done by slicing: if the amount
+        isn't a whole number, or if ink would be shifted off the image or smeared
+        by `scipy.ndimage.shift`'s "nearest" edge mode."""
+        if amount != int(amount):
+            return None
+        amount = int(amount)
+        if self.side == "right":
+            shift = -amount
+        else:
+            shift = amount
+        if abs(shift) > self.width:
+            return None
+        if np.any(self.has_ink):
+            if self.leftmost + shift < 0 or self.rightmost + shift > self.width - 1:
+                return None
+            if shift > 0 and self.leftmost == 0:
+                return None
+        return self.canvas[:, self.width - amount:2*self.width - amount]
+
+class PairGeometry(object):
+    """The parts of `CounterSpace.pair_area` which don't depend on the options: the
+    countershape between a pair of glyphs at a given distance, and the points from
+    which the lights shine. `area(options)` only has to evaluate the lights at the
+    pixels of the countershape."""
+    def __init__(self, union, alpha, theta):
+        self.union = union
+        self.box_height, self.box_width = union.shape
+        self.theta = theta
+        self.empty = not np.any(union)
+        if self.empty: return
+        y_center, x_center = scipy.ndimage.center_of_mass(union)
+        self.x_center, self.y_center = x_center, y_center
+        self.top_x = int((x_center) + (y_center) / np.tan(alpha))
+        self.bottom_x = int((x_center) - (self.box_height-y_center) / np.tan(alpha))
+
+        # Where the countershape's pixels fall on the (flipped) grid of `CounterSpace.gaussian`
+        ys, xs = np.nonzero(union)
+        self.window = (ys.min(), ys.max() + 1, xs.min(), xs.max() + 1)
+        fx = self.box_width / 2. - xs
+        fy = ys - self.box_height / 2. + 1
+        self.xp = fx * np.cos(theta) - fy * np.sin(theta)
+        self.yp = fx * np.sin(theta) + fy * np.cos(theta)
+
+    def offsets(self, center_x, center_y):
+        """The (rotated) offsets of the countershape's pixels from a light's centre."""
+        c, s = np.cos(self.theta), np.sin(self.theta)
+        center_x = self.box_width/2 - center_x
+        center_y = self.box_height/2 - (self.box_height - center_y)
+        center_x = center_x * c - center_y * s
+        center_y = center_x * s + center_y * c
+        return center_x-self.xp, center_y-self.yp
+
+    def light(self, center_x, center_y, width_x, width_y):
+        """The light `CounterSpace.gaussian` would give, at the countershape's pixels only."""
+        dx, dy = self.offsets(center_x, center_y)
+        return np.exp(-((dx/float(width_x))**2 + (dy/float(width_y))**2)/2.)
+
+    def area(self, options):
+        """The summed area of the lit countershape (as `np.sum(pair_area(...))`)."""
+        if self.empty: return 0.0
+        toplight    = self.light(self.top_x,0,options["w_top"],options["h_top"])
+        bottomlight = self.light(self.bottom_x,self.box_height,options["w_bottom"],options["h_bottom"])
+        centerlight = self.light(self.x_center,self.y_center,options["w_center"],options["h_center"])
+        return np.sum(centerlight * options["center_strength"] + bottomlight * options["bottom_strength"] + toplight * options["top_strength"])
+
+    def area_gradient(self, options, variables):
+        """Returns the area, along with its derivatives with respect to each of the named
+        options. As each light is a gaussian, for a light of width `w` at an offset `dx`
+        d(light)/dw = light * dx**2 / w**3; its strength just scales it."""
+        gradient = dict((v, 0.0) for v in variables)
+        if self.empty: return 0.0, np.zeros(len(variables))
+        area = 0.0
+        for name, x, y in [("top", self.top_x, 0), ("bottom", self.bottom_x, self.box_height), ("center", self.x_center, self.y_center)]:
+            dx, dy = self.offsets(x, y)
+            w, h = float(options["w_"+name]), float(options["h_"+name])
+            strength = options[name+"_strength"]
+            light = np.exp(-((dx/w)**2 + (dy/h)**2)/2.)
+            total = np.sum(light)
+            area += strength * total
+            gradient[name+"_strength"] = total
+            gradient["w_"+name] = strength * np.dot(light, dx**2) / w**3
+            gradient["h_"+name] = strength * np.dot(light, dy**2) / h**3
+        return area, np.array([gradient[v] for v in variables])
 
 class CounterSpace:
     def __init__(self, file,
@@ -26,6 +261,13 @@ class CounterSpace:
         serif_smoothing = 2,
         key_pairs = ["HH","OO","HO","OH","EE","AV"],
         x_height_in_pixels = 90,
+        search = "bisect",
+        store = None,
+        caches = None,
+        parameter_store = None,
+        pyramid_factor = 4,
+        instrumentation = None,
+        compact = False,
         ):
         """
         To begin using CounterSpace, create a new `Counterspace` object by passing in the
@@ -33,13 +275,38 @@ OpenType font filename, and the following keyword parameters:
 
 * `bare_minimum`: Minimum ink-to-ink distance. Default is 30 units. Increase this if "VV" is too close.
 * `serif_smoothing`: Default is 0. Amount of blurring applied. Increase to 20 or so if you have prominent serifs.
+* `search`: How `space` looks for the crossing distance. `"bisect"` (the default) gallops forward and
+  then bisects; `"linear"` tries every pixel distance in turn; `"pyramid"` first spaces the pair at
+  `1/pyramid_factor` of the resolution, then bisects in a narrow window around that distance. Pyramid
+  search is not a speed-up: spacing the coarse copy costs about what it saves, and it has been slower
+  than `"bisect"` at every resolution tried (36 pairs of the benchmark sans took 0.53s against 0.49s
+  at the default 90 pixels, and 11.2s against 9.1s at 360). `benchmark.py` reports both.
+* `store`: A `SpacingStore` in which to keep the results of `space`, so they can be reused in later runs.
+* `caches`: A `CachePool` to hold the spacer's (and its font's) caches. Pass `CachePool(max_bytes=...)` to
+  run within a fixed memory budget; by default the caches are unbounded.
+* `parameter_store`: A `ParameterStore` in which to keep the options fitted by `determine_parameters`.
+* `instrumentation`: An `Instrumentation` with which to count and time the stages of the work (see `stats`).
+* `compact`: Keep the prepared glyph images as `float32` (or, once serif smoothing has made them binary, as
+  `bool`) rather than `float64`, to save memory. The spacings found are the same. Needs the `GlyphRendering`
+  of `tensorfontglyphs`.
     """
         self.filename = file
         self.font = Font(self.filename, x_height_in_pixels)
+        self.x_height_in_pixels = x_height_in_pixels
         self.bare_minimum = bare_minimum * self.font.scale_factor
         self.serif_smoothing = serif_smoothing
         self.absolute_maximum = int(absolute_maximum * self.font.scale_factor)
         self.key_pairs = key_pairs
+        self.search = search
+        self.store = store
+        self.parameter_store = parameter_store
+        self.pyramid_factor = pyramid_factor
+        self.instrumentation = instrumentation or NullInstrumentation()
+        if compact and not hasattr(GlyphRendering, "compacted"):
+            raise ValueError("This GlyphRendering has no compact mode")
+        self.compact = compact
+        self._coarse = None
+        self.chunk_size = 16
         self.options = None
 
         self.box_height = self.font.full_height_px
@@ -51,10 +318,26 @@ OpenType font filename, and the following keyword parameters:
         self.alpha = (90 - self.font.italic_angle) * np.pi/180
 
         # Various caches
-        self._counters = {}
-        self._lshifted_counters = {}
-        self._rshifted_counters = {}
-        self._pair_areas = {}
+        if caches is None:
+            caches = CachePool()
+        self.caches = caches
+        self._counters = caches.cache("counters")
+        self._smoothed = caches.cache("smoothed")
+        self._reduced = caches.cache("reduced")
+        self._profiles = caches.cache("profiles")
+        self._lshifted_counters = caches.cache("lshifted_counters")
+        self._rshifted_counters = caches.cache("rshifted_counters")
+        self._geometries = caches.cache("geometries")
+        self._area_curves = caches.cache("area_curves")
+        self._fingerprints = caches.cache("fingerprints")
+        self._spacings = caches.cache("spacings")
+        self._light_templates = caches.cache("light_templates", max_entries = 6)
+        self.font.glyphcache = caches.cache("glyphs")
+        if hasattr(self.font, "contourcache"):
+            self.font.contourcache = caches.cache("contours")
+        if hasattr(self.font, "renderingcache"):
+            self.font.renderingcache = caches.cache("renderings")
+        self._kernel_spectra = caches.cache("kernel_spectra")
 
         hh = self.box_height / 2.
         bw = self.box_width / 2.
@@ -77,11 +360,35 @@ OpenType font filename, and the following keyword parameters:
             g = np.exp(
                 -(((center_x-xp)/width_x)**2+
                   ((center_y-yp)/width_y)**2)/2.)
-            return np.flip(g,axis=1)
+            return np.flip(g,axis=-1)
         self.gaussian = gaussian
 
         self.set_serif_smoothing(serif_smoothing)
 
+    def light(self, center_x, center_y, width_x, width_y, window = None):
+        """Returns the same light as `self.gaussian(center_x, center_y, width_x, width_y, self.theta)`,
+        but cut from a cached `LightTemplate`. If the centres are arrays, a stack of lights
+        is returned, cut from the template together. If a `window` of rows and columns `(top, bottom, left, right)` is given,
+        only that part of the box is lit."""
+        key = (float(width_x), float(width_y), self.theta)
+        template = self._light_templates.get(key)
+        if template is None:
+            template = LightTemplate(width_x, width_y, self.theta, self.box_height, self.box_width,
+                (self.fx[0,0], self.fy[0,0]), getattr(self.caches, "max_value_bytes", None))
+            self._light_templates[key] = template
+        computed = template.template is not None
+        center_x, center_y = np.broadcast_arrays(np.asarray(center_x, dtype=float), np.asarray(center_y, dtype=float))
+        lights, cut = template.lights(center_x.ravel(), center_y.ravel(), window)
+        for i in np.flatnonzero(~cut):
+            g = self.gaussian(center_x.flat[i], center_y.flat[i], width_x, width_y, self.theta)
+            if window is not None:
+                g = g[window[0]:window[1], window[2]:window[3]]
+            lights[i] = g
+        if not computed and template.template is not None:
+            # Stored again, so that the pool counts the template's memory
+            self._light_templates[key] = template
+        return lights.reshape(center_x.shape + lights.shape[1:])
+
     def set_serif_smoothing(self, serif_smoothing):
         self.serif_smoothing = serif_smoothing
         if serif_smoothing > 0:
@@ -89,53 +396,160 @@ OpenType font filename, and the following keyword parameters:
             lim = max(np.log(2*np.pi)/a, 1.)
             self.kernel = -np.sin(np.exp(-a*self.fx)) * np.where(self.fx>-lim, 1, 0) * a**2 * np.exp(-(self.fy/serif_smoothing)**2/2.)
             self.kernel *= self.kernel > 0
+            # Most of the kernel is zero; only its support takes part in the convolution
+            rows, cols = np.flatnonzero(self.kernel.any(axis=1)), np.flatnonzero(self.kernel.any(axis=0))
+            top, left = (rows[0], cols[0]) if len(rows) else (0, 0)
+            self._kernel_support = (self.kernel[top:rows[-1]+1, left:cols[-1]+1] if len(rows) else self.kernel[:1,:1],
+                (self.kernel.shape[0] - 1) // 2 - top, (self.kernel.shape[1] - 1) // 2 - left)
         else:
             self.kernel = None
-        self._lshifted_counters = {}
-        self._rshifted_counters = {}
+        self._kernel_spectra.clear()
+        self._smoothed.clear()
+        self._reduced.clear()
+        self._profiles.clear()
+        self._lshifted_counters.clear()
+        self._rshifted_counters.clear()
+        self._geometries.clear()
+        self._area_curves.clear()
 
     def counters(self, glyph):
         if glyph in self._counters: return self._counters[glyph]
         fg = self.font.glyph(glyph)
-        self._counters[glyph] = fg.as_matrix(normalize=True).with_padding_to_constant_box_width(self.box_width).mask_ink_to_edge()
-        return self._counters[glyph]
+        result = fg.as_matrix(normalize=True).with_padding_to_constant_box_width(self.box_width).mask_ink_to_edge()
+        self._counters[glyph] = result
+        return result
 
-    def lshifted_counter(self, glyph, amount,reftop, refbottom):
-        if (glyph,amount,reftop,refbottom) in self._lshifted_counters: return self._lshifted_counters[(glyph,amount,reftop,refbottom)]
-        fg = self.font.glyph(glyph).as_matrix()
-        conc = 0
-        if fg.discontinuity(contour="right") > 0:
-            conc = 1-fg.right_face()
+    def smoothed(self, glyph):
+        """Returns the glyph with serif smoothing applied: convolved with the smoothing
+        kernel and thresholded. This doesn't depend on the side or reference band, so
+        it is done once per glyph."""
+        if glyph in self._smoothed: return self._smoothed[glyph]
+        fg = self.rendering(glyph)
+        with self.instrumentation.timer("convolve"):
+            result = self._rendering(fg._glyph, self.convolve_kernel(fg) > 250)
+        self._smoothed[glyph] = result
+        return result
+
+    def rendering(self, glyph):
+        """Returns the glyph's `as_matrix()` rendering, timed as "rasterize". Where the
+        font keeps each glyph's rendering, only the first (the one that renders) is timed."""
+        fg = self.font.glyph(glyph)
+        if hasattr(self.font, "is_rendered") and self.font.is_rendered(glyph):
+            return fg.as_matrix()
+        with self.instrumentation.timer("rasterize"):
+            return fg.as_matrix()
+
+    def _rendering(self, glyph, matrix):
+        if self.compact:
+            return GlyphRendering.init_from_numpy(glyph, matrix, compact=True)
+        return GlyphRendering.init_from_numpy(glyph, matrix)
+
+    def convolve_kernel(self, image):
+        """Returns the same as `scipy.signal.convolve(image, self.kernel, mode="same")`.
+        Only the kernel's support is convolved with, by FFTs of a size fixed by the box,
+        so that its spectrum is worked out once and reused for every glyph (until the
+        smoothing is changed); only images bigger than the box need another."""
+        kernel, dy, dx = self._kernel_support
+        kh, kw = kernel.shape
+        shape = (next_fast_len(max(image.shape[0], self.box_height) + kh - 1, True),
+                 next_fast_len(max(image.shape[1], self.box_width) + kw - 1, True))
+        spectrum = self._kernel_spectra.get(shape)
+        if spectrum is None:
+            spectrum = rfft2(kernel, shape)
+            self._kernel_spectra[shape] = spectrum
+        full = irfft2(rfft2(np.asarray(image, dtype=float), shape) * spectrum, shape)
+        full = full[:image.shape[0] + kh - 1, :image.shape[1] + kw - 1]
+        # "same" output pixel (i, j) is the full convolution's (i + dy, j + dx)
+        result = np.zeros(image.shape)
+        h, w = image.shape
+        y0, x0 = max(dy, 0), max(dx, 0)
+        y1, x1 = max(min(dy + h, full.shape[0]), y0), max(min(dx + w, full.shape[1]), x0)
+        result[y0 - dy:y1 - dy, x0 - dx:x1 - dx] = full[y0:y1, x0:x1]
+        return result
+
+    def concavity_reduced(self, glyph, side, reftop, refbottom):
+        """Returns the glyph (smoothed, if serif smoothing is on) padded to the box width,
+        masked to the reference band, and with the concavities of the given side ("left"
+        or "right") reduced. None of this depends on how far the glyph is then shifted,
+        so it is done once per glyph and reference band."""
+        key = (glyph, side, reftop, refbottom)
+        if key in self._reduced: return self._reduced[key]
+        timer = self.instrumentation.timer
+        fg = self.rendering(glyph)
+        with timer("concavity_reduction"):
+            conc = 0
+            if fg.discontinuity(contour=side) > 0:
+                if side == "right":
+                    conc = 1-fg.right_face()
+                else:
+                    conc = 1-fg.left_face()
         if self.kernel is not None:
-            fg = GlyphRendering.init_from_numpy(fg._glyph,convolve(fg,self.kernel,mode="same") > 250)
+            fg = self.smoothed(glyph)
+        elif self.compact:
+            fg = fg.compacted()
         padded = fg.with_padding_to_constant_box_width(self.box_width)
         padded[0:reftop,:]   = 0
         padded[refbottom:,:] = 0
-        padded = padded.reduce_concavity(conc)
-        c = scipy.ndimage.shift(padded, (0,amount), mode="nearest")
-        l,r = GlyphRendering.init_from_numpy(glyph, c).mask_ink_to_edge()
+        with timer("concavity_reduction"):
+            result = padded.reduce_concavity(conc)
+        self._reduced[key] = result
+        return result
+
+    def edge_profile(self, glyph, side, reftop, refbottom):
+        """Returns the `EdgeProfile` of the given side of the prepared glyph."""
+        key = (glyph, side, reftop, refbottom)
+        if key in self._profiles: return self._profiles[key]
+        reduced = self.concavity_reduced(glyph, side, reftop, refbottom)
+        with self.instrumentation.timer("edge_mask"):
+            result = EdgeProfile(reduced, side)
+        self._profiles[key] = result
+        return result
+
+    def lshifted_counter(self, glyph, amount,reftop, refbottom):
+        profile = self.edge_profile(glyph, "right", reftop, refbottom)
+        with self.instrumentation.timer("shift"):
+            r = profile.shifted(amount)
+        if r is not None:
+            self.instrumentation.count("shift_from_profile")
+            return r
+        if (glyph,amount,reftop,refbottom) in self._lshifted_counters: return self._lshifted_counters[(glyph,amount,reftop,refbottom)]
+        padded = self.concavity_reduced(glyph, "right", reftop, refbottom)
+        with self.instrumentation.timer("shift"):
+            c = scipy.ndimage.shift(np.asarray(padded, dtype=float), (0,amount), mode="nearest")
+        with self.instrumentation.timer("edge_mask"):
+            l,r = GlyphRendering.init_from_numpy(glyph, c).mask_ink_to_edge()
         r = (r>0).astype(np.uint8)
         self._lshifted_counters[(glyph,amount,reftop,refbottom)] = r
         return r
 
     def rshifted_counter(self,glyph,amount,reftop,refbottom):
+        profile = self.edge_profile(glyph, "left", reftop, refbottom)
+        with self.instrumentation.timer("shift"):
+            l = profile.shifted(amount)
+        if l is not None:
+            self.instrumentation.count("shift_from_profile")
+            return l
         if (glyph,amount,reftop,refbottom) in self._rshifted_counters: return self._rshifted_counters[(glyph,amount,reftop,refbottom)]
-        fg = self.font.glyph(glyph).as_matrix()
-        conc = 0
-        if fg.discontinuity(contour="left") > 0:
-            conc = 1-fg.left_face()
-        if self.kernel is not None:
-            fg = GlyphRendering.init_from_numpy(fg._glyph,convolve(fg,self.kernel,mode="same") > 250)
-        padded = fg.with_padding_to_constant_box_width(self.box_width)
-        padded[0:reftop,:]   = 0
-        padded[refbottom:,:] = 0
-        padded = padded.reduce_concavity(conc)
-        c = scipy.ndimage.shift(padded, (0,amount), mode="nearest")
-        l,r = GlyphRendering.init_from_numpy(glyph, c).mask_ink_to_edge()
+        padded = self.concavity_reduced(glyph, "left", reftop, refbottom)
+        with self.instrumentation.timer("shift"):
+            c = scipy.ndimage.shift(np.asarray(padded, dtype=float), (0,amount), mode="nearest")
+        with self.instrumentation.timer("edge_mask"):
+            l,r = GlyphRendering.init_from_numpy(glyph, c).mask_ink_to_edge()
         l = (l>0).astype(np.uint8)
         self._rshifted_counters[(glyph,amount,reftop,refbottom)] = l
         return l
 
+    def cache_stats(self):
+        """Returns hit, miss and eviction counts, entry counts and memory use for each
+        of the spacer's caches, and the total memory they hold (under `"bytes"`)."""
+        return self.caches.stats()
+
+    def stats(self):
+        """Returns the call counts and timings of each stage of the work, if the spacer
+        was given an `Instrumentation` (under `"stages"`), and the `cache_stats`
+        (under `"caches"`)."""
+        return {"stages": self.instrumentation.stats(), "caches": self.cache_stats()}
+
     def reference_pair(self,l,r):
         reference = "HH"
         if l in string.ascii_lowercase and r in string.ascii_lowercase:
@@ -146,35 +560,42 @@ OpenType font filename, and the following keyword parameters:
             reference = "nn"
         return reference
 
-    def pair_area(self, l, r, options, dist = None,reference=None):
-        """Measure the area of the counter-space between two glyphs, set at
-        a given distance. If the distance is got provided, then it is taken
-        from the font's metrics. The glyphs are masked to the height of the
-        reference pair."""
+    def reference_band(self, reference):
+        """Returns the top and bottom rows of the band, taken from the reference pair,
+        to which the countershapes are masked."""
         f = self.font
-        if dist is None:
-            dist = f.pair_distance(l,r)
-        if reference is None:
-            reference = self.reference_pair(l,r)
-        shift_l, shift_r = f.shift_distances(l,r,dist)
-
         lref, rref = [f.glyph(ref) for ref in reference]
         reftop = int(min(lref.tsb,rref.tsb))
         refbottom = int(min(lref.tsb+lref.ink_height, rref.tsb+rref.ink_height))
         reftop = reftop + self.serif_smoothing
         refbottom = refbottom - self.serif_smoothing
-        sigmas_top    = (options["w_top"], options["h_top"])
-        sigmas_bottom = (options["w_bottom"], options["h_bottom"])
-        sigmas_center = (options["w_center"], options["h_center"])
+        return reftop, refbottom
 
-        top_strength = options["top_strength"]
-        bottom_strength = options["bottom_strength"]
-        center_strength = options["center_strength"]
+    def reference_area(self, reference):
+        """The area of the counter-space of the reference pair at its own spacing;
+        other pairs are spaced so as to match it. It is measured by `pair_areas`, as
+        the pairs being spaced are, so that the reference pair spaced against itself
+        comes out exactly at its own spacing."""
+        key = self._curve_key(None, None, reference)
+        if key in self._area_curves: return self._area_curves[key]
+        l, r = reference
+        result = self.pair_areas(l, r, self.options, [self.font.pair_distance(l, r)], reference=reference)[0]
+        self._area_curves[key] = result
+        return result
 
-        redgeofl = (self.box_width - f.glyph(l).ink_width) / 2.0 + f.glyph(l).ink_width + shift_l
-        ledgeofr = self.box_width-((self.box_width - f.glyph(r).ink_width) / 2.0 + f.glyph(r).ink_width) + shift_r
-        center = (redgeofl + ledgeofr)/2 - f.minimum_ink_distance(l, r) / 2
-        midline = (reftop+refbottom)/2 - self.box_height/2
+    def pair_geometry(self, l, r, dist = None, reference = None):
+        """Returns the `PairGeometry` of the pair set at the given distance (by
+        default, taken from the font's metrics), masked to the height of the
+        reference pair. These are remembered until the serif smoothing changes."""
+        f = self.font
+        if dist is None:
+            dist = f.pair_distance(l,r)
+        if reference is None:
+            reference = self.reference_pair(l,r)
+        key = (l, r, dist, reference)
+        if key in self._geometries: return self._geometries[key]
+        shift_l, shift_r = f.shift_distances(l,r,dist)
+        reftop, refbottom = self.reference_band(reference)
 
         # This mask ensures we only care about the area "between" the
         # glyphs, and don't get into e.g. interior counters of "PP"
@@ -186,19 +607,34 @@ OpenType font filename, and the following keyword parameters:
 
         # If the light was from the middle, this is where it would be
         union = np.array(((l_shifted + r_shifted) * ink_mask) > 0)
-        y_center, x_center = scipy.ndimage.measurements.center_of_mass(union)
-        if np.isnan(y_center) or np.isnan(y_center): return union
-        top_x = int((x_center) + (y_center) / np.tan(self.alpha))
-        bottom_x = int((x_center) - (self.box_height-y_center) / np.tan(self.alpha))
-        top_y = 0
-        bottom_y = self.box_height
-
-        # Blur the countershape slightly
-        union = union > 0
+        with self.instrumentation.timer("centre_of_mass"):
+            result = PairGeometry(union, self.alpha, self.theta)
+        self._geometries[key] = result
+        return result
+
+    def pair_area(self, l, r, options, dist = None,reference=None):
+        """Measure the area of the counter-space between two glyphs, set at
+        a given distance. If the distance is got provided, then it is taken
+        from the font's metrics. The glyphs are masked to the height of the
+        reference pair. The lights are only worked out over the part of the box which
+        the countershape covers; the rest of the result is zero."""
+        geometry = self.pair_geometry(l, r, dist, reference)
+        union = geometry.union
+        if geometry.empty: return union
+        top, bottom, left, right = window = geometry.window
+        sigmas_top    = (options["w_top"], options["h_top"])
+        sigmas_bottom = (options["w_bottom"], options["h_bottom"])
+        sigmas_center = (options["w_center"], options["h_center"])
+
+        top_strength = options["top_strength"]
+        bottom_strength = options["bottom_strength"]
+        center_strength = options["center_strength"]
+
         # Now shine two lights from top and bottom
-        toplight    = self.gaussian(top_x,top_y,sigmas_top[0],sigmas_top[1],self.theta)
-        bottomlight = self.gaussian(bottom_x,bottom_y,sigmas_bottom[0],sigmas_bottom[1],self.theta)
-        centerlight = self.gaussian(x_center,y_center,sigmas_center[0],sigmas_center[1],self.theta)
+        with self.instrumentation.timer("lights"):
+            toplight    = self.light(geometry.top_x,0,sigmas_top[0],sigmas_top[1],window)
+            bottomlight = self.light(geometry.bottom_x,self.box_height,sigmas_bottom[0],sigmas_bottom[1],window)
+            centerlight = self.light(geometry.x_center,geometry.y_center,sigmas_center[0],sigmas_center[1],window)
 
         # XXX - this "shadowing" idea doesn't quite work
         
@@ -218,10 +654,103 @@ OpenType font filename, and the following keyword parameters:
         #             fnonz = True
 
         #     #     print("Total light:", np.sum( top_strength * toplight + bottomlight ))
-        union =  centerlight * center_strength * union + union * bottomlight * bottom_strength + union * ( top_strength * toplight)
-        return union
+        lit = np.zeros(union.shape)
+        union = union[top:bottom, left:right]
+        lit[top:bottom, left:right] = centerlight * center_strength * union + union * bottomlight * bottom_strength + union * ( top_strength * toplight)
+        return lit
+
+    def pair_areas(self, l, r, options, distances, reference=None, chunk_size=None):
+        """Measure the summed area of the counter-space between two glyphs at each
+        of an array of distances. This gives the same results as summing `pair_area`
+        at each distance, but stacks the countershapes into a (distances x height x width)
+        array and lights them all together. At most `chunk_size` distances (by default,
+        `self.chunk_size`) are stacked at a time, to cap memory use. Only the rows of the
+        reference band and the columns between the glyphs' facing edges are lit."""
+        f = self.font
+        if reference is None:
+            reference = self.reference_pair(l,r)
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        distances = np.asarray(distances)
+        reftop, refbottom = self.reference_band(reference)
+        # The rows which masking everything outside the band leaves
+        band = np.ones(self.box_height, dtype=bool)
+        band[0:reftop] = False
+        band[refbottom:] = False
+        ys = np.flatnonzero(band)
+
+        timer = self.instrumentation.timer
+        self.instrumentation.count("pair_area", len(distances))
+        areas = np.zeros(len(distances))
+        if not len(ys): return areas
+        top, bottom = ys[0], ys[-1] + 1
+        for start in range(0, len(distances), chunk_size):
+            # Each shifted counter times its own preparation and shift
+            shift_l, shift_r = f.shift_distances(l,r,distances[start:start+chunk_size])
+            l_shifted = [self.lshifted_counter(l,s,reftop,refbottom) for s in shift_l]
+            r_shifted = [self.rshifted_counter(r,s,reftop,refbottom) for s in shift_r]
+            with timer("shift"):
+                l_shifted, r_shifted = np.array(l_shifted), np.array(r_shifted)
+            with timer("edge_mask"):
+                # Outside the band there's nothing to light
+                union = (l_shifted[:,top:bottom] > 0) & (r_shifted[:,top:bottom] > 0)
+
+            with timer("centre_of_mass"):
+                total = np.sum(union, axis=(1,2))
+                found = total > 0
+                if not np.any(found): continue
+                union = union[found]
+                # A float total, so that Python 2 doesn't floor the centre
+                total = total[found].astype(float)
+                y_center = np.dot(np.sum(union, axis=2), ys) / total
+                x_center = np.dot(np.sum(union, axis=1), np.arange(self.box_width)) / total
+                top_x = np.trunc((x_center) + (y_center) / np.tan(self.alpha))
+                bottom_x = np.trunc((x_center) - (self.box_height-y_center) / np.tan(self.alpha))
+
+            # Each countershape is lit only between the glyphs' facing edges. The window is
+            # worked out for each distance alone, so that an area doesn't depend on which
+            # other distances it was measured alongside; the chunk's lights are cut over
+            # the columns spanned by all the windows, and each sliced to its own window.
+            windows = []
+            for i in range(len(union)):
+                columns = np.flatnonzero(np.any(union[i], axis=0))
+                windows.append((columns[0], columns[-1] + 1))
+            left, right = min(w[0] for w in windows), max(w[1] for w in windows)
+            window = (top, bottom, left, right)
+            with timer("lights"):
+                toplight    = self.light(top_x,0,options["w_top"],options["h_top"],window)
+                bottomlight = self.light(bottom_x,self.box_height,options["w_bottom"],options["h_bottom"],window)
+                centerlight = self.light(x_center,y_center,options["w_center"],options["h_center"],window)
+                lit = centerlight * options["center_strength"] + bottomlight * options["bottom_strength"] + toplight * options["top_strength"]
+            with timer("reduction"):
+                for i, n in enumerate(start + np.flatnonzero(found)):
+                    first, last = windows[i]
+                    areas[n] = np.sum(union[i][:,first:last] * lit[i][:,first-left:last-left])
+        return areas
+
+    def determine_parameters(self, callback = None, spacing_class = None, starts = 1, workers = 1, tolerance = None):
+        """Fits the options so that each of the key pairs has the same area as the first
+        (reference) pair, and returns them. With a `parameter_store`, options fitted before
+        for the same key pairs and glyphs are reused; otherwise the fit starts from the
+        nearest stored options for the `spacing_class` (by default, named after the
+        reference pair) and the result is stored.
+
+        The fit is local, so a poor start gives a poor fit. With `starts` greater than one,
+        the fit is also run from `starts - 1` other starting points spread out over the
+        bounds, shared out between `workers` processes, and the best fit is kept. If a fit
+        comes out with an error under `tolerance`, the others are abandoned. The `callback`
+        is called with the error of each evaluation, or, with several starts, of each fit."""
+        if spacing_class is None:
+            spacing_class = self.key_pairs[0]
+        start = {}
+        if self.parameter_store is not None:
+            key = self.parameter_key()
+            stored = self.parameter_store.get(key)
+            if stored is not None:
+                self.options = stored
+                return stored
+            start = self.parameter_store.nearest(spacing_class, self.key_pairs) or {}
 
-    def determine_parameters(self, callback = None):
         bounds_for = {
             "w_center": (5,1000),
             "h_center": (10,1000),
@@ -232,76 +761,546 @@ OpenType font filename, and the following keyword parameters:
             "top_strength": (0.05,1),
             "bottom_strength": (0.05,1),
         }
-        def solve_for(variables, strings, options):
-            reference = strings.pop(0)
-            bounds = [bounds_for[v] for v in variables]
-            guess =  [options[v] for v in variables]
+        variables = ["h_center","w_center","h_top","w_top","top_strength","h_bottom","w_bottom","bottom_strength"]
+        options = {
+            "w_top": 15,
+            "w_bottom": 15,
+            "h_top": 15,
+            "h_bottom": 15,
+            "h_center": 1000,
+            "w_center": 1000,
+            "top_strength": 0.1,
+            "bottom_strength": 0.1,
+            "center_strength": 1
+        }
+        options.update(start)
+        bounds = [bounds_for[v] for v in variables]
+        guesses = [[np.clip(options[v], *bounds_for[v]) for v in variables]]
+        low, high = np.array(bounds, dtype=float).T
+        guesses.extend(low + halton(starts - 1, len(variables)) * (high - low))
+
+        # Only the lights change from one try to the next, so the countershapes are found once
+        reference, strings = self.key_pairs[0], self.key_pairs[1:]
+        fit = (variables, bounds, options,
+            self.pair_geometry(reference[0],reference[1]),
+            [self.pair_geometry(s[0],s[1]) for s in strings])
+
+        if starts == 1:
             def comparator(o):
-                for ix,var in enumerate(variables):
-                    options[var] = o[ix]
-                HH = np.sum(self.pair_area(reference[0],reference[1],options))
-                err = []
-                for s in strings:
-                    val = np.sum(self.pair_area(s[0],s[1],options))
-                    err.append( ( val - HH) / HH )
-                err = np.sum(np.array(err) ** 2)
+                with self.instrumentation.timer("objective"):
+                    err, gradient = _parameter_error(o, *fit)
                 if callback:
                     callback(err)
-                return err
-            result = scipy.optimize.minimize(comparator,guess,
-                method="TNC",
-                bounds=bounds,
-                options={
-                    # 'maxfev': 200
-                    'xtol': 0.01,
-                    'eta': 0.8
-                },
-                )
-            for ix,var in enumerate(variables):
-                options[var] = result.x[ix]
-            return options
-
-        options = solve_for(
-            variables = ["h_center","w_center","h_top","w_top","top_strength","h_bottom","w_bottom","bottom_strength"],
-            strings = self.key_pairs,
-            options = {
-                "w_top": 15,
-                "w_bottom": 15,
-                "h_top": 15,
-                "h_bottom": 15,
-                "h_center": 1000,
-                "w_center": 1000,
-                "top_strength": 0.1,
-                "bottom_strength": 0.1,
-                "center_strength": 1
-            }
-        )
+                return err, gradient
+            with self.instrumentation.timer("determine_parameters"):
+                result = _minimize(comparator, guesses[0], bounds)
+            best = (result.fun, list(result.x))
+        else:
+            best = None
+            if workers <= 1 or not isinstance(self.filename, str):
+                _init_fitter(fit)
+                results = map(_fit_from, guesses)
+                pool = None
+            else:
+                pool = multiprocessing.Pool(workers, initializer=_init_fitter, initargs=(fit,))
+                results = pool.imap_unordered(_fit_from, guesses)
+            started = default_timer()
+            try:
+                for result in results:
+                    if callback:
+                        callback(result[0])
+                    if best is None or result[0] < best[0]:
+                        best = result
+                    if tolerance is not None and best[0] < tolerance:
+                        break
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+            self.instrumentation.record("determine_parameters", default_timer() - started)
+
+        error, x = best
+        options = dict(options)
+        for ix,var in enumerate(variables):
+            options[var] = x[ix]
+        if self.parameter_store is not None:
+            self.parameter_store.put(key, spacing_class, self.key_pairs, options, error)
         self.options = options
         return options
 
+    def parameter_key(self):
+        """A key for the options fitted by `determine_parameters`: a hash of the settings
+        which affect the fit, the key pairs, the fingerprints of their glyphs and their
+        spacings (sidebearings and kerning), at which the fit measures them."""
+        settings = [self.x_height_in_pixels, self.serif_smoothing, list(self.key_pairs), float(self.font.italic_angle)]
+        glyphs = [self.glyph_fingerprint(g) for pair in self.key_pairs for g in pair]
+        glyphs += [float(self.font.pair_distance(pair[0], pair[1])) for pair in self.key_pairs]
+        return hashlib.sha1(repr((settings, glyphs)).encode("utf-8")).hexdigest()
+
+    def glyph_fingerprint(self, glyph):
+        """A hash of the glyph's rendering and metrics, which changes if the glyph is edited."""
+        if glyph in self._fingerprints: return self._fingerprints[glyph]
+        g = self.font.glyph(glyph)
+        m = np.ascontiguousarray(self.rendering(glyph), dtype=np.float64)
+        h = hashlib.sha1(m.tobytes())
+        h.update(repr((m.shape, g.ink_width, g.ink_height, g.tsb)).encode("utf-8"))
+        result = h.hexdigest()
+        self._fingerprints[glyph] = result
+        return result
+
+    def spacing_key(self, l, r):
+        """A key for the result of `space(l, r)`: a hash of the settings which affect
+        it, the fingerprints of the pair and its reference pair, and the reference pair's
+        spacing (its sidebearings and kerning), which sets the area the pair is spaced to."""
+        reference = self.reference_pair(l,r)
+        settings = [self.x_height_in_pixels, float(self.bare_minimum), self.absolute_maximum,
+            self.serif_smoothing, self.search, sorted((k, float(v)) for k,v in self.options.items()),
+            float(self.font.italic_angle), float(self.font.pair_distance(*reference))]
+        glyphs = [self.glyph_fingerprint(g) for g in [l, r] + list(reference)]
+        return hashlib.sha1(repr((settings, glyphs)).encode("utf-8")).hexdigest()
+
     def space(self, l, r):
+        """Returns the distance, in font units, at which the pair should be set.
+        Results are remembered (and kept in `self.store`, if there is one) until
+        the settings or glyphs change."""
         if not self.options:
             raise ValueError("You need to run .determine_parameters() or set self.options manually")
+        key = self.spacing_key(l, r)
+        if key in self._spacings: return self._spacings[key]
+        result = None
+        if self.store is not None:
+            result = self.store.get(key)
+        if result is None:
+            with self.instrumentation.timer("space"):
+                result = self._space(l, r)
+            if self.store is not None:
+                self.store.put(key, l, r, result)
+        self._spacings[key] = result
+        return result
+
+    def area_curve(self, l, r, reference):
+        """The areas of the pair's countershape measured so far, by pixel distance, for
+        the current options. These don't depend on `bare_minimum` or `absolute_maximum`,
+        so when those change, `space` only has to measure distances it hasn't tried."""
+        return self._area_curves.get(self._curve_key(l, r, reference), {})
+
+    def _areas(self, l, r, reference, ns):
+        """The pair's areas at the pixel distances `ns`, measuring only those not already
+        on its area curve."""
+        key = self._curve_key(l, r, reference)
+        areas = self._area_curves.get(key, {})
+        missing = [n for n in ns if not n in areas]
+        if missing:
+            areas.update(zip(missing, self.pair_areas(l,r,self.options,missing,reference=reference)))
+            # Stored again, so that the cache accounts for the areas just measured
+            self._area_curves[key] = areas
+        return [areas[n] for n in ns]
+
+    def _curve_key(self, l, r, reference):
+        return (l, r, reference, tuple(sorted((k, float(v)) for k,v in self.options.items())))
+
+    def _space(self, l, r):
         reference = self.reference_pair(l,r)
-        u_good = np.sum(self.pair_area(reference[0],reference[1], self.options, reference=reference))
-        mid = self.font.minimum_ink_distance(l, r)
-        rv = None
+        u_good = self.reference_area(reference)
+        if hasattr(self.font, "contours"):
+            # Found (and the glyphs rendered) first, so that ink_distance times only the distance
+            self.contours(l)
+            self.contours(r)
+        with self.instrumentation.timer("ink_distance"):
+            mid = self.font.minimum_ink_distance(l, r)
+        start = -int(mid)+int(self.bare_minimum)
+
+        def area(*ns):
+            areas = self._areas(l, r, reference, ns)
+            return areas[0] if len(ns) == 1 else areas
+
+        if self.search == "linear":
+            n = self._linear_search(area, u_good, start, self.absolute_maximum)
+        elif self.search == "bisect":
+            n = self._bisect_search(area, u_good, start, self.absolute_maximum, self.area_curve(l, r, reference))
+        elif self.search == "pyramid":
+            n = self._pyramid_search(l, r, reference, area, u_good, start, self.absolute_maximum)
+        else:
+            raise ValueError("Unknown search mode %s" % self.search)
+        return int(n / self.font.scale_factor)
+
+    def _linear_search(self, area, u_good, start, stop):
+        """Returns the first distance in `range(start, stop)` at which the area
+        goes over `u_good`, or the distance of peak area if it never does."""
         peak = -1
         peak_idx = -1
-        goneover = False
+        for window in range(start, stop, self.chunk_size):
+            ns = range(window, min(window + self.chunk_size, stop))
+            for n, u in zip(ns, area(*ns)):
+                if u > u_good:
+                    return n
+                if u > peak:
+                    peak = u
+                    peak_idx = n
+        return peak_idx
+
+    def _known_bracket(self, known, u_good, start, stop):
+        """Looks among the `known` areas (by distance) in `range(start, stop)` for the
+        closest pair of distances either side of the crossing point, returning them
+        and their areas, or `None` if there isn't one or the known areas are not
+        steadily increasing. If the area is over `u_good` at `start`, the first
+        distance and area returned are `None`."""
+        points = sorted((n, u) for n, u in known.items() if start <= n < stop)
+        if any(u1 < u0 for (n0, u0), (n1, u1) in zip(points, points[1:])):
+            return None
+        above = [(n, u) for n, u in points if u > u_good]
+        below = [(n, u) for n, u in points if u <= u_good]
+        if above and above[0][0] == start:
+            return (None, None) + above[0]
+        if not above or not below:
+            return None
+        return below[-1] + above[0]
+
+    def _bisect_search(self, area, u_good, start, stop, known = None):
+        """Like `_linear_search`, but brackets the crossing point by galloping
+        forward in doubling steps and then bisects it. If the `known` areas already
+        bracket the crossing point, it goes straight to bisecting. If the samples show that
+        the area curve is not monotonic, or it never goes over `u_good`, we
+        fall back to the linear scan (which also finds the peak)."""
+        if start >= stop:
+            return self._linear_search(area, u_good, start, stop)
+        bracket = self._known_bracket(known or {}, u_good, start, stop)
+        if bracket is not None:
+            lo, u_lo, hi, u_hi = bracket
+            if lo is None:
+                return hi
+        else:
+            lo, u_lo = start, area(start)
+            if u_lo > u_good:
+                return lo
+            step = 1
+            while True:
+                hi = min(lo + step, stop - 1)
+                if hi == lo:
+                    return self._linear_search(area, u_good, start, stop)
+                u_hi = area(hi)
+                if u_hi < u_lo:
+                    return self._linear_search(area, u_good, start, stop)
+                if u_hi > u_good:
+                    break
+                lo, u_lo = hi, u_hi
+                step = step * 2
 
-        for n in range(-int(mid)+int(self.bare_minimum),self.absolute_maximum,1):
-            u = np.sum(self.pair_area(l,r,self.options,dist=n, reference=reference))
+        while hi - lo > 1:
+            n = (lo + hi) // 2
+            u = area(n)
+            if u < u_lo or u > u_hi:
+                return self._linear_search(area, u_good, start, stop)
             if u > u_good:
-                rv = n
-                goneover = True
-                break
-            if u > peak:
-                peak = u
-                peak_idx = n
-        if rv is None:
-            return int(peak_idx / self.font.scale_factor)
-        return int(rv / self.font.scale_factor)
+                hi, u_hi = n, u
+            else:
+                lo, u_lo = n, u
+        return hi
+
+    def _pyramid_search(self, l, r, reference, area, u_good, start, stop):
+        """Like `_bisect_search`, but first finds roughly where the crossing point is by
+        spacing the pair with `coarse_spacer`, and measures the areas either side of
+        that, so that if they bracket the crossing point only the window between them is
+        bisected. Otherwise, the search carries on as `_bisect_search` would."""
+        guess = int(self.coarse_spacer().space(l, r) * self.font.scale_factor)
+        window = 2 * self.pyramid_factor
+        lo, hi = max(start, guess - window), min(stop - 1, guess + window)
+        if lo < hi:
+            area(lo, hi)
+        return self._bisect_search(area, u_good, start, stop, self.area_curve(l, r, reference))
+
+    def coarse_spacer(self):
+        """A `CounterSpace` for the same font at `1/pyramid_factor` of the resolution, with
+        the same settings and options (with the lights' sizes scaled to match). If the
+        spacer's pool has a `namespace`, its caches come out of the same budget, under names
+        starting "coarse."; otherwise it has a pool of its own with the same `max_bytes`."""
+        if self._coarse is None:
+            if hasattr(self.caches, "namespace"):
+                caches = self.caches.namespace("coarse.")
+            else:
+                caches = CachePool(getattr(self.caches, "max_bytes", None))
+            self._coarse = CounterSpace(self.filename,
+                x_height_in_pixels = self.x_height_in_pixels / float(self.pyramid_factor),
+                serif_smoothing = int(round(self.serif_smoothing / float(self.pyramid_factor))),
+                key_pairs = self.key_pairs,
+                caches = caches,
+                instrumentation = self.instrumentation,
+                compact = self.compact,
+            )
+        coarse = self._coarse
+        ratio = coarse.font.scale_factor / self.font.scale_factor
+        serif_smoothing = int(round(self.serif_smoothing * ratio))
+        if coarse.serif_smoothing != serif_smoothing:
+            coarse.set_serif_smoothing(serif_smoothing)
+        coarse.bare_minimum = self.bare_minimum * ratio
+        coarse.absolute_maximum = int(self.absolute_maximum * ratio)
+        coarse.options = dict((k, v * ratio if k[0] in "wh" else v) for k, v in self.options.items())
+        return coarse
+
+    def accuracy_report(self, pairs, search = "pyramid"):
+        """Spaces the pairs with the given `search` and with `"bisect"`, returning how
+        often and by how much (in font units) the results differ, and the time each took.
+        Each search is made by a fresh copy of the spacer, so that neither benefits from
+        the glyphs the other (or this spacer) has already prepared."""
+        results = {}
+        times = {}
+        for mode in [search, "bisect"]:
+            state = self._worker_state()
+            state["search"] = mode
+            spacer = _spacer_from(state)
+            started = time.perf_counter()
+            results[mode] = [spacer._space(l, r) for l, r in pairs]
+            times[mode] = time.perf_counter() - started
+        errors = np.abs(np.array(results[search]) - np.array(results["bisect"]))
+        return {
+            "pairs": len(pairs),
+            "mismatches": int(np.sum(errors > 0)),
+            "max_error": int(np.max(errors)) if len(pairs) else 0,
+            "mean_error": float(np.mean(errors)) if len(pairs) else 0.0,
+            "time": times[search],
+            "bisect_time": times["bisect"],
+        }
+
+    def known_spacing(self, l, r):
+        """Returns the result of `space(l, r)` if it is already remembered or in the
+        store, or `None` if it would have to be worked out."""
+        key = self.spacing_key(l, r)
+        result = self._spacings.get(key)
+        if result is None and self.store is not None:
+            result = self.store.get(key)
+            if result is not None:
+                self._spacings[key] = result
+        return result
+
+    def space_matrix(self, lefts, rights, workers = 1, callback = None):
+        """Spaces every pair of a glyph from `lefts` and a glyph from `rights`, returning
+        a `len(lefts)` x `len(rights)` matrix of distances in font units. See `space_pairs`."""
+        # An OrderedDict drops repeats without a scan per pair, keeping the order on Python 2 too
+        pairs = list(OrderedDict.fromkeys((l, r) for l in lefts for r in rights))
+        results = self.space_pairs(pairs, workers=workers, callback=callback)
+        matrix = np.zeros((len(lefts), len(rights)), dtype=int)
+        for i, l in enumerate(lefts):
+            for j, r in enumerate(rights):
+                matrix[i, j] = results[(l, r)]
+        return matrix
+
+    def space_pairs(self, pairs, workers = 1, callback = None):
+        """Spaces a list of `(l, r)` pairs, returning a dictionary of their distances in
+        font units. With `workers` greater than one, the pairs are shared out between a
+        pool of processes; the options, the glyphs' edges and contours and the reference
+        pairs' areas are worked out here and sent to each process once, when it starts,
+        so that the workers don't render the glyphs again (though in `"pyramid"` search
+        each still renders its coarse copies). If a `callback` is given, it is called with
+        `(l, r, distance)` as each pair is done.
+
+        Pairs already known (remembered, or in `self.store`) are not recomputed. Inside
+        Glyphs, where the font can't be sent to other processes, the work is done here."""
+        if not self.options:
+            raise ValueError("You need to run .determine_parameters() or set self.options manually")
+        results = {}
+        todo = []
+
+        def record(l, r, result):
+            results[(l, r)] = result
+            if callback:
+                callback(l, r, result)
+
+        for l, r in pairs:
+            result = self.known_spacing(l, r)
+            if result is None:
+                todo.append((l, r))
+            else:
+                record(l, r, result)
+
+        if workers <= 1 or not isinstance(self.filename, str):
+            for l, r in todo:
+                record(l, r, self.space(l, r))
+            return results
+
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(self._worker_state(todo),))
+        try:
+            chunksize = max(1, len(todo) // (workers * 8))
+            for l, r, result in pool.imap_unordered(_space_pair, todo, chunksize):
+                key = self.spacing_key(l, r)
+                self._spacings[key] = result
+                if self.store is not None:
+                    self.store.put(key, l, r, result)
+                record(l, r, result)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    def kern_pairs(self, pairs, sidebearings, threshold = 5, workers = 1, callback = None):
+        """Works out the kerning of a list of `(l, r)` pairs, given a dictionary of
+        `(lsb, rsb)` `sidebearings`. Kerns of `threshold`
+        font units or less are dropped, and so before spacing a pair we first check (with
+        `spacing_within`, which costs two area measurements) whether its kern could be
+        any bigger than that; if not, the search is skipped.
+
+        Returns a dictionary of the kerns over the threshold, and a report of how many
+        pairs were `skipped` and how many were `evaluated`. The `callback` is called with
+        `(l, r, distance, kern)` for each pair; for skipped pairs, the distance is `None`
+        and the kern 0."""
+        kerns = {}
+        report = {"skipped": 0, "evaluated": 0}
+        u_goods = {}
+        todo = []
+        for l, r in pairs:
+            unkerned = sidebearings[l][1] + sidebearings[r][0]
+            if self.known_spacing(l, r) is None:
+                reference = self.reference_pair(l, r)
+                if not reference in u_goods:
+                    u_goods[reference] = self.reference_area(reference)
+                if self.spacing_within(l, r, unkerned - threshold, unkerned + threshold, u_goods[reference]):
+                    report["skipped"] += 1
+                    if callback:
+                        callback(l, r, None, 0)
+                    continue
+            todo.append((l, r))
+
+        def record(l, r, distance):
+            kern = distance - (sidebearings[l][1] + sidebearings[r][0])
+            report["evaluated"] += 1
+            if abs(kern) > threshold:
+                kerns[(l, r)] = kern
+            if callback:
+                callback(l, r, distance, kern)
+        self.space_pairs(todo, workers=workers, callback=record)
+        return kerns, report
+
+    def _worker_state(self, pairs = ()):
+        """Everything a worker process needs to make a copy of this spacer and space the
+        `pairs`: whatever the glyphs would otherwise be rendered for there is worked out here."""
+        for l, r in pairs:
+            reference = self.reference_pair(l, r)
+            reftop, refbottom = self.reference_band(reference)
+            self.edge_profile(l, "right", reftop, refbottom)
+            self.edge_profile(r, "left", reftop, refbottom)
+            self.reference_area(reference)
+            if hasattr(self.font, "contours"):
+                self.contours(l)
+                self.contours(r)
+        return {
+            "filename": self.filename,
+            "x_height_in_pixels": self.x_height_in_pixels,
+            "serif_smoothing": self.serif_smoothing,
+            "key_pairs": self.key_pairs,
+            "search": self.search,
+            "pyramid_factor": self.pyramid_factor,
+            "compact": self.compact,
+            "max_bytes": getattr(self.caches, "max_bytes", None),
+            "bare_minimum": self.bare_minimum,
+            "absolute_maximum": self.absolute_maximum,
+            "options": self.options,
+            "profiles": self._profiles.items(),
+            "contours": self.font.contourcache.items() if hasattr(self.font, "contourcache") else [],
+            "reference_areas": [(key, area) for key, area in self._area_curves.items() if key[0] is None],
+        }
+
+    def contours(self, glyph):
+        """Returns the glyph's left and right contours and a mask of its blank scanlines,
+        as the in-tree fonts' `Font.contours` does; `tensorfont`'s fonts don't have it, so
+        for them they are taken from the rendering."""
+        if hasattr(self.font, "contours"):
+            if not glyph in self.font.contourcache:
+                self.rendering(glyph)
+            return self.font.contours(glyph)
+        matrix = self.rendering(glyph)
+        blank = matrix.left_contour(max_depth=-1) == -1
+        return (matrix.left_contour(max_depth=0), matrix.right_contour(max_depth=0), blank)
+
+    def kerning_classes(self, glyphs, side, tolerance = 1, discontinuity_tolerance = 0.05):
+        """Groups glyphs whose `side` ("left" or "right") edges have the same shape
+        into classes, returned as lists whose first member is the class representative.
+        Edges match if, once aligned, their contours are no more than `tolerance` pixels
+        apart on every scanline and their `discontinuity` differs by no more than
+        `discontinuity_tolerance`. Glyphs are only grouped with others which are spaced
+        against the same reference pair."""
+        contour = 0 if side == "left" else 1
+        edges = []
+        for g in glyphs:
+            contours = self.contours(g)
+            blank = contours[2]
+            c = contours[contour].astype(int)
+            if not np.all(blank):
+                c = c - np.min(c[~blank])
+            category = (g in string.ascii_uppercase, g in string.ascii_lowercase)
+            discontinuity = self.rendering(g).discontinuity(contour=side)
+            edges.append((category, blank, c, discontinuity))
+
+        first = {}
+        for i, g in enumerate(glyphs):
+            first.setdefault(g, i)
+        classes = []
+        for g, (category, blank, c, discontinuity) in zip(glyphs, edges):
+            for members in classes:
+                rep_category, rep_blank, rep_c, rep_discontinuity = edges[first[members[0]]]
+                if (category == rep_category and np.array_equal(blank, rep_blank)
+                        and np.all(np.abs(c - rep_c) <= tolerance)
+                        and abs(discontinuity - rep_discontinuity) <= discontinuity_tolerance):
+                    members.append(g)
+                    break
+            else:
+                classes.append([g])
+        return classes
+
+    def spacing_within(self, l, r, low, high, u_good = None):
+        """Checks, without searching, whether `space(l, r)` would come out between `low`
+        and `high` font units (inclusive): the area must still be under the reference area
+        just before the pixel distances which round into that range, and over it by the
+        last of them. Like the bisecting search, this assumes the area grows steadily
+        with distance."""
+        s = self.font.scale_factor
+        candidates = range(int(np.floor((low - 1) * s)) - 1, int(np.ceil((high + 1) * s)) + 2)
+        start = -int(self.font.minimum_ink_distance(l, r)) + int(self.bare_minimum)
+        ns = [n for n in candidates if low <= int(n / s) <= high and start <= n < self.absolute_maximum]
+        if not ns:
+            return False
+        reference = self.reference_pair(l, r)
+        if u_good is None:
+            u_good = self.reference_area(reference)
+        if ns[0] == start:
+            return self._areas(l, r, reference, [ns[-1]])[0] > u_good
+        below, above = self._areas(l, r, reference, [ns[0] - 1, ns[-1]])
+        return below <= u_good < above
+
+    def verify_spacing(self, l, r, distance, u_good = None):
+        """Checks, without searching, whether `space(l, r)` would come out as `distance`
+        (in font units). See `spacing_within`."""
+        return self.spacing_within(l, r, distance, distance, u_good)
+
+    def class_space_matrix(self, lefts, rights, workers = 1, callback = None, tolerance = 1):
+        """Like `space_matrix`, but only spaces the representatives of the left classes
+        of `lefts` and the right classes of `rights` (see `kerning_classes`). Every
+        other pair is checked against its classes' distance with `verify_spacing`, and
+        spaced in full only if that fails. Returns the matrix, the left and right classes,
+        and a dictionary of the pairs which are exceptions to their classes' distance."""
+        left_classes = self.kerning_classes(list(lefts), "right", tolerance)
+        right_classes = self.kerning_classes(list(rights), "left", tolerance)
+        class_matrix = self.space_matrix([c[0] for c in left_classes], [c[0] for c in right_classes],
+            workers=workers, callback=callback)
+
+        column = dict((g, j) for j, g in enumerate(rights))
+        row = dict((g, i) for i, g in enumerate(lefts))
+        matrix = np.zeros((len(lefts), len(rights)), dtype=int)
+        exceptions = {}
+        u_goods = {}
+        for ci, lclass in enumerate(left_classes):
+            for cj, rclass in enumerate(right_classes):
+                distance = class_matrix[ci, cj]
+                for l in lclass:
+                    for r in rclass:
+                        if l != lclass[0] or r != rclass[0]:
+                            reference = self.reference_pair(l, r)
+                            if not reference in u_goods:
+                                u_goods[reference] = self.reference_area(reference)
+                            if not self.verify_spacing(l, r, distance, u_goods[reference]):
+                                exceptions[(l, r)] = self.space(l, r)
+                            if callback:
+                                callback(l, r, exceptions.get((l, r), distance))
+                        matrix[row[l], column[r]] = exceptions.get((l, r), distance)
+        return matrix, left_classes, right_classes, exceptions
 
     def derive_sidebearings(self, g, keyglyph = None):
         if keyglyph is None:
@@ -341,6 +1340,91 @@ OpenType font filename, and the following keyword parameters:
             urlretrieve(sample_fonts[name], name)
             print("Downloaded %s" % name)
 
+def halton(n, dimensions):
+    """The first `n` points of the Halton sequence in `dimensions` dimensions: points
+    in the unit cube which are spread out evenly, without any regular pattern."""
+    primes = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29][:dimensions]
+    points = np.zeros((n, dimensions))
+    for d, base in enumerate(primes):
+        for i in range(n):
+            f, k = 1.0, i + 1
+            while k > 0:
+                f = f / base
+                points[i, d] += f * (k % base)
+                k = k // base
+    return points
+
+def _parameter_error(o, variables, bounds, options, reference_geometry, geometries):
+    """The error of the key pairs' areas against the reference pair's area, and its
+    gradient, when the named `variables` take the values `o`."""
+    options = dict(options)
+    for ix,var in enumerate(variables):
+        options[var] = o[ix]
+    HH, dHH = reference_geometry.area_gradient(options, variables)
+    err = 0.0
+    gradient = np.zeros(len(variables))
+    for geometry in geometries:
+        val, dval = geometry.area_gradient(options, variables)
+        e = ( val - HH) / HH
+        err += e ** 2
+        gradient += 2 * e * (dval * HH - val * dHH) / HH ** 2
+    return err, gradient
+
+def _minimize(comparator, guess, bounds):
+    return scipy.optimize.minimize(comparator,guess,
+        jac=True,
+        method="TNC",
+        bounds=bounds,
+        options={
+            # 'maxfev': 200
+            'xtol': 0.01,
+            'eta': 0.8
+        },
+        )
+
+_fit = None
+
+def _init_fitter(fit):
+    global _fit
+    _fit = fit
+
+def _fit_from(guess):
+    result = _minimize(lambda o: _parameter_error(o, *_fit), guess, _fit[1])
+    return result.fun, list(result.x)
+
+_worker_spacer = None
+
+def _spacer_from(state):
+    """Makes a spacer from a `_worker_state`, leaving out what it has prepared (the
+    profiles, contours and reference areas)."""
+    spacer = CounterSpace(state["filename"],
+        x_height_in_pixels = state["x_height_in_pixels"],
+        serif_smoothing = state["serif_smoothing"],
+        key_pairs = state["key_pairs"],
+        search = state["search"],
+        pyramid_factor = state["pyramid_factor"],
+        compact = state["compact"],
+        caches = CachePool(state["max_bytes"]),
+    )
+    spacer.bare_minimum = state["bare_minimum"]
+    spacer.absolute_maximum = state["absolute_maximum"]
+    spacer.options = state["options"]
+    return spacer
+
+def _init_worker(state):
+    global _worker_spacer
+    _worker_spacer = _spacer_from(state)
+    for key, profile in state["profiles"]:
+        _worker_spacer._profiles[key] = profile
+    for glyph, contours in state["contours"]:
+        _worker_spacer.font.contourcache[glyph] = contours
+    for key, area in state["reference_areas"]:
+        _worker_spacer._area_curves[key] = area
+
+def _space_pair(pair):
+    l, r = pair
+    return l, r, _worker_spacer._space(l, r)
+
 if __name__ == '__main__':
     c = CounterSpace("OpenSans-Regular.ttf",serif_smoothing=0)
     print("Determining parameters", end="")
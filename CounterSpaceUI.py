@@ -9,8 +9,10 @@ from AppKit import NSRunLoop
 from vanilla import *
 from itertools import tee,izip
 import CounterSpace
+from SpacingStore import SpacingStore, ParameterStore
 import string
 import traceback
+import os
 
 def pairwise(iterable):
   a, b = tee(iterable)
@@ -26,6 +28,11 @@ class CounterSpaceUI(object):
     self.prespaced = { "caps": [], "caplower": [], "lower": [] }
     self.bare_minimum = 20
     self.serif_smoothing = 0
+    self.store = None
+    self.parameter_store = None
+    if Glyphs.font.filepath:
+      self.store = SpacingStore(os.path.splitext(Glyphs.font.filepath)[0] + ".counterspace")
+      self.parameter_store = ParameterStore(self.store.filename)
     self.view.setMaster(self.master)
     self.view.setFrame_(((0, 0), (880, 200)))
     self.view.setString("")
@@ -50,7 +57,7 @@ class CounterSpaceUI(object):
     self.w.textBox3b = TextBox((10,130,-10,14),"Comma-separated list of pairs whose spacing is used as an example. The following pairs are silently added: HH,OO,HO,OH, Ho,To,Th,Hh, oo,nn,on,no,te,rg,ge.",sizeStyle="small",selectable=False)
 
     self.w.recomputeButton = Button((10,170,150,17),"Compute parameters", callback = self.runSolver)
-    self.w.textBoxRCP = TextBox((10,190,-10,14),"(NB: This takes a long time but you need to do it!)",sizeStyle="small",selectable=False)
+    self.w.textBoxRCP = TextBox((10,190,-10,14),"(You need to do this! Fitted parameters are remembered with the font.)",sizeStyle="small",selectable=False)
     self.w.bar = ProgressBar((10, 220, -10, 16),minValue =0 , maxValue = 100)
     self.w.errorBox = TextBox((10, 250, -10, 16),"")
 
@@ -86,7 +93,8 @@ class CounterSpaceUI(object):
         for s in csl:
             self.prespaced[self.spacingClass(s)].append(s)
         for k in ["caps","caplower","lower"]:
-            self.prespaced[k] = list(set(self.prespaced[k]))
+            # Keep the order, so that the reference pair stays first
+            self.prespaced[k] = sorted(set(self.prespaced[k]), key=self.prespaced[k].index)
         print("Set spaced pairs called")
         self.needsRecomputing()
     except Exception as e:
@@ -99,7 +107,9 @@ class CounterSpaceUI(object):
         self.spacers[c] = CounterSpace.CounterSpace(self.master,
           bare_minimum=self.bare_minimum,
           serif_smoothing=self.serif_smoothing,
-          key_pairs = self.prespaced[c]
+          key_pairs = self.prespaced[c],
+          store = self.store,
+          parameter_store = self.parameter_store
         )
     self.w.recomputeButton.enable(True)
     self.w.editText.enable(False)
@@ -113,15 +123,10 @@ class CounterSpaceUI(object):
     self.w.bar.set(0)
     self.w.recomputeButton.enable(False)
 
-    for c in ["lower"]:
+    for c in ["caps", "caplower", "lower"]:
         print("Determining parameters for %s" % c)
-        result = self.spacers[c].determine_parameters(callback = lambda err:self.progress(err))
-        self.spacers[c].options = result
+        result = self.spacers[c].determine_parameters(callback = lambda err:self.progress(err), spacing_class = c)
         print("Result for %s : %s" % (c,result))
-
-    self.spacers["caps"].options = {'bottom_strength': 1.1345652573787253, 'h_top': 5.487824242337442, 'h_center': 5.931368743262439, 'h_bottom': 15.282101114272237, 'w_top': 27.21495352061693, 'w_center': 58.93266226658602, 'top_strength': 0.5915259512256053, 'center_strength': 0.07957667771756849, 'w_bottom': 12.07849643211549}
-    # self.spacers["lower"].options =  {'bottom_strength': 5.236787909255455, 'h_top': -13.434270522062697, 'h_center': 47.60847066913675, 'h_bottom': 5.990015356494567, 'w_top': -7.108329693663322, 'w_center': 0.47190584344597786, 'top_strength': -0.9089546341683743, 'center_strength': 0.06563161642247345, 'w_bottom': 32.21412242837695}
-    self.spacers["caplower"].options =  {'bottom_strength': -2.422052201203848, 'h_top': -12.393311309708867, 'h_center': 51.62401673223201, 'h_bottom': 12.732836126432804, 'w_top': 139.33317239248765, 'w_center': -0.7569307267200843, 'top_strength': 1.7618843046229808, 'center_strength': 7.0190999837101, 'w_bottom': 56.97695661416948}
     self.w.bar.set(100)
     self.spacing={}
     self.setStringAndDistances(self.w.editText.get())
@@ -142,7 +147,8 @@ class CounterSpaceUI(object):
     bm = int(sender.get())
     self.w.bareMinTextBox.set(str(bm))
     for c in ["caps", "lower", "caplower"]:
-        self.spacers[c].bare_minimum = bm
+        self.spacers[c].bare_minimum = bm * self.spacers[c].font.scale_factor
+    # The spacers keep each pair's area curve, so respacing at the new minimum is quick
     self.spacing = {}
     self.editTextCallback(self.w.editText)
 
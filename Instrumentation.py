@@ -0,0 +1,94 @@
+# coding: utf-8
+from timeit import default_timer
+
+
+class Instrumentation(object):
+    """Counts calls to, and times, the stages of `CounterSpace`'s work (rendering,
+    convolution, concavity reduction, shifting, edge masking, centre of mass,
+    lights and so on). Pass one to `CounterSpace(instrumentation=...)` and read the
+    results with `CounterSpace.stats()`. The stages don't overlap, apart from "space"
+    and "determine_parameters", which time the whole of each call.
+
+    If a `sink` is given, each timing and count is also passed on to it, as
+    `sink.timing(name, milliseconds)` and `sink.incr(name, count)` (the interface
+    of the usual StatsD clients), with `prefix` added to the stage name."""
+
+    enabled = True
+
+    def __init__(self, sink = None, prefix = "counterspace."):
+        self.sink = sink
+        self.prefix = prefix
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+        self.times = {}
+
+    def timer(self, stage):
+        """A context manager which times the code within it as a call to `stage`."""
+        return _Timer(self, stage)
+
+    def record(self, stage, seconds):
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        if self.sink is not None:
+            self.sink.timing(self.prefix + stage, seconds * 1000.0)
+
+    def count(self, stage, n = 1):
+        """Counts `n` calls to an (untimed) stage."""
+        self.calls[stage] = self.calls.get(stage, 0) + n
+        if self.sink is not None:
+            self.sink.incr(self.prefix + stage, n)
+
+    def stats(self):
+        """Returns a dictionary of the calls to and total time (in seconds) spent in
+        each stage."""
+        stats = {}
+        for stage, calls in self.calls.items():
+            stats[stage] = {"calls": calls}
+            if stage in self.times:
+                stats[stage]["time"] = self.times[stage]
+                stats[stage]["mean_time"] = self.times[stage] / calls
+        return stats
+
+
+class NullInstrumentation(object):
+    """The instrumentation used when none is asked for, which does nothing."""
+
+    enabled = False
+
+    def timer(self, stage):
+        return _null_timer
+
+    def record(self, stage, seconds):
+        pass
+
+    def count(self, stage, n = 1):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class _Timer(object):
+    def __init__(self, instrumentation, stage):
+        self.instrumentation = instrumentation
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation.record(self.stage, default_timer() - self.started)
+        return False
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_null_timer = _NullTimer()
@@ -0,0 +1,111 @@
+# coding: utf-8
+import json
+import os
+
+
+class SpacingJournal(object):
+    """An append-only log of the results of a spacing run, written one JSON
+    record per line as each result is produced, so that an interrupted run can
+    carry on from where it stopped.
+
+    The journal starts with a `header` describing what was spaced (the font's hash,
+    the settings and the key pairs), so that a journal left by a run on another
+    version of the font isn't taken for this one's. Then come the fitted
+    `parameters`, each glyph's `sidebearings` and each pair's `kern` (with its
+    spacing, or `null` if the pair was found to need no kerning without being
+    spaced), and finally, once the results have been saved, a `complete` record.
+
+    A half-written final line (from a run which was killed mid-write) is discarded
+    when the journal is reopened; a bad line anywhere else raises a `ValueError`."""
+
+    def __init__(self, filename, restart = False):
+        self.filename = filename
+        self._clear()
+        if restart and os.path.exists(filename):
+            os.remove(filename)
+        if os.path.exists(filename):
+            self._read()
+        self.file = open(filename, "a")
+
+    def _clear(self):
+        self.header = None
+        self.parameters = None
+        self.sidebearings = {}
+        self.kerns = {}
+        self.complete = False
+
+    def _read(self):
+        with open(self.filename, "rb") as f:
+            lines = f.readlines()
+        end = 0
+        for number, line in enumerate(lines):
+            try:
+                record = json.loads(line.decode("utf-8"))
+            except ValueError:
+                record = None
+            if record is None or not line.endswith(b"\n"):
+                if number < len(lines) - 1:
+                    raise ValueError("%s is corrupt at line %i" % (self.filename, number + 1))
+                break
+            self._apply(record)
+            end += len(line)
+        # Drop a torn final line, so new records start on a line of their own
+        with open(self.filename, "r+b") as f:
+            f.truncate(end)
+
+    def restart(self, header = None):
+        """Discards everything in the journal, starting it again with the given header."""
+        self.file.close()
+        self.file = open(self.filename, "w")
+        self._clear()
+        if header is not None:
+            self.write_header(header)
+
+    def _apply(self, record):
+        if record["type"] == "header":
+            self.header = record["header"]
+        elif record["type"] == "complete":
+            self.complete = True
+        elif record["type"] == "parameters":
+            self.parameters = record["options"]
+        elif record["type"] == "sidebearings":
+            self.sidebearings[record["glyph"]] = (record["lsb"], record["rsb"])
+        elif record["type"] == "kern":
+            self.kerns[(record["l"], record["r"])] = (record["space"], record["kern"])
+
+    def _write(self, record):
+        self._apply(record)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def write_header(self, header):
+        self._write({"type": "header", "header": header})
+
+    def mark_complete(self):
+        """Records that the run finished and its results were saved, so that it
+        isn't resumed."""
+        self._write({"type": "complete"})
+
+    def write_parameters(self, options):
+        self._write({"type": "parameters", "options": options})
+
+    def write_sidebearings(self, glyph, lsb, rsb):
+        self._write({"type": "sidebearings", "glyph": glyph, "lsb": int(lsb), "rsb": int(rsb)})
+
+    def write_kern(self, l, r, space, kern):
+        if space is not None:
+            space = int(space)
+        self._write({"type": "kern", "l": l, "r": r, "space": space, "kern": int(kern)})
+
+    def feature_file(self, glyph_name = lambda g: g, threshold = 0):
+        """Returns the journal's kerning as a feature file. Kerns of `threshold` or
+        less (in absolute value) are left out."""
+        lines = ["feature kern {"]
+        for (l, r), (space, kern) in self.kerns.items():
+            if abs(kern) > threshold:
+                lines.append("    pos %s %s %i;" % (glyph_name(l), glyph_name(r), kern))
+        lines.append("} kern;")
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,80 @@
+# coding: utf-8
+import json
+import sqlite3
+
+
+class SpacingStore(object):
+    """A persistent store of `CounterSpace.space` results, kept in an SQLite
+    database so that results survive between runs.
+
+    Results are stored under the key computed by `CounterSpace.spacing_key`,
+    which fingerprints the glyphs involved and the spacer's settings; if a glyph
+    is edited, only the pairs involving it (or the reference glyphs) miss."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS spacing (key TEXT PRIMARY KEY, l TEXT, r TEXT, result INTEGER)")
+
+    def get(self, key):
+        row = self.db.execute("SELECT result FROM spacing WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def put(self, key, l, r, result):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO spacing VALUES (?, ?, ?, ?)", (key, l, r, int(result)))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM spacing").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class ParameterStore(object):
+    """A persistent store of the options fitted by `CounterSpace.determine_parameters`,
+    kept in an SQLite database (which may be the same file as a `SpacingStore`).
+
+    Options are stored under the key computed by `CounterSpace.parameter_key`, along
+    with the spacing class and key pairs they were fitted for, so that a fit which
+    has no exact match can start from the nearest one: the same key pairs in a sibling
+    master, say, or the previous fit with one fewer key pair."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS parameters (key TEXT PRIMARY KEY, class TEXT, key_pairs TEXT, options TEXT, error REAL)")
+
+    def get(self, key):
+        row = self.db.execute("SELECT options FROM parameters WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def nearest(self, spacing_class, key_pairs):
+        """Returns the stored options for the spacing class whose key pairs have most
+        in common with `key_pairs` (preferring the better fit among equals), or `None`."""
+        best, best_score = None, None
+        wanted = set(key_pairs)
+        for stored_pairs, options, error in self.db.execute("SELECT key_pairs, options, error FROM parameters WHERE class = ?", (spacing_class,)):
+            stored_pairs = set(json.loads(stored_pairs))
+            score = (len(wanted & stored_pairs) / float(len(wanted | stored_pairs)), -error)
+            if best_score is None or score > best_score:
+                best, best_score = json.loads(options), score
+        return best
+
+    def put(self, key, spacing_class, key_pairs, options, error):
+        options = dict((k, float(v)) for k, v in options.items())
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO parameters VALUES (?, ?, ?, ?, ?)",
+                (key, spacing_class, json.dumps(list(key_pairs)), json.dumps(options), float(error)))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM parameters").fetchone()[0]
+
+    def close(self):
+        self.db.close()
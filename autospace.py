@@ -1,15 +1,32 @@
 from CounterSpace import CounterSpace
+from SpacingStore import SpacingStore, ParameterStore
+from SpacingJournal import SpacingJournal
+import argparse
+import hashlib
+import json
 import string
 import sys
 import os
 
 from fontTools.ttLib import TTFont
 
-c = CounterSpace(sys.argv[1],serif_smoothing=0)
-filename, file_extension = os.path.splitext(sys.argv[1])
+parser = argparse.ArgumentParser(description="Autospace and autokern a font with CounterSpace")
+parser.add_argument("font", help="TrueType font to space")
+parser.add_argument("--cache", help="File in which to keep spacing results between runs (default: FONT.counterspace)")
+parser.add_argument("--no-cache", action="store_true", help="Recompute every pair from scratch")
+parser.add_argument("--journal", help="File to which results are written as they are produced (default: FONT.journal)")
+parser.add_argument("--restart", action="store_true", help="Discard the journal of an earlier, interrupted run instead of resuming it")
+parser.add_argument("--from-journal", action="store_true", help="Write out the results in the journal without spacing anything")
+parser.add_argument("--fea", help="Also write the kerning to this feature file")
+parser.add_argument("--classes", action="store_true", help="Only space one glyph of each group of glyphs with matching edges, checking the rest")
+parser.add_argument("--starts", type=int, default=1, help="Number of starting points from which to fit the parameters, keeping the best fit")
+parser.add_argument("--workers", type=int, default=1, help="Number of processes to fit and kern with")
+args = parser.parse_args()
+
+filename, file_extension = os.path.splitext(args.font)
 spaced_filename = "%s-autospaced%s" % (filename,file_extension)
 
-ttfont = TTFont(c.font.filename)
+ttfont = TTFont(args.font)
 if not "glyf" in ttfont:
     print("Sorry, currently only supports truetype fonts. :-(")
     sys.exit(1)
@@ -21,28 +38,82 @@ def set_sidebearings(g,new_lsb,new_rsb):
     ttfont["hmtx"].metrics[g] = (new_lsb+ink_width+new_rsb, new_lsb)
     ttfont["glyf"][g].coordinates -= (old_lsb-new_lsb,0)
 
-print("Determining parameters...")
-c.determine_parameters()
+store = None
+parameter_store = None
+if not args.no_cache and not args.from_journal:
+    store = SpacingStore(args.cache or "%s.counterspace" % args.font)
+    parameter_store = ParameterStore(store.filename)
+c = CounterSpace(args.font,serif_smoothing=0,store=store,parameter_store=parameter_store)
+
+# What the results depend on; a journal written for a different font or settings isn't used
+with open(args.font, "rb") as f:
+    font_hash = hashlib.sha1(f.read()).hexdigest()
+header = json.loads(json.dumps({
+    "font": font_hash,
+    "settings": {"serif_smoothing": c.serif_smoothing, "x_height_in_pixels": c.x_height_in_pixels},
+    "key_pairs": c.key_pairs,
+}))
+journal = SpacingJournal(args.journal or "%s.journal" % args.font, restart=args.restart)
+if args.from_journal:
+    if journal.header != header:
+        print("%s was not written for this font and these settings" % journal.filename)
+        sys.exit(1)
+elif journal.header != header or journal.complete:
+    if journal.header is not None:
+        print("Not resuming from %s, which is %s" % (journal.filename,
+            "from a finished run" if journal.header == header else "for a different font or settings"))
+    journal.restart(header)
+
+if not args.from_journal:
+    if journal.parameters:
+        print("Resuming from "+journal.filename)
+        c.options = journal.parameters
+    else:
+        print("Determining parameters...")
+        c.determine_parameters(starts=args.starts, workers=args.workers)
+        journal.write_parameters(c.options)
 
-print("Spacing...")
-lsbs = {}
-rsbs = {}
-for g in string.ascii_uppercase:
-    lsbs[g], rsbs[g] = c.derive_sidebearings(g)
-    print("%s LSB = %i, RSB = %i" % (g,lsbs[g],rsbs[g]))
-    set_sidebearings(g,lsbs[g],rsbs[g])
+    print("Spacing...")
+    for g in string.ascii_uppercase:
+        if not g in journal.sidebearings:
+            journal.write_sidebearings(g, *c.derive_sidebearings(g))
+        print("%s LSB = %i, RSB = %i" % (g, *journal.sidebearings[g]))
 
-print("\nKerning...")
-for l in string.ascii_uppercase:
-    for r in string.ascii_uppercase:
+    print("\nKerning...")
+    for (l, r), (desiredspace, kernvalue) in journal.kerns.items():
+        if desiredspace is not None:
+            c._spacings[c.spacing_key(l, r)] = desiredspace
+    def kern(l, r, desiredspace, kernvalue = None):
+        if (l, r) in journal.kerns:
+            return
+        if kernvalue is None:
+            kernvalue = desiredspace - (journal.sidebearings[l][1] + journal.sidebearings[r][0])
+        journal.write_kern(l, r, desiredspace, kernvalue)
         print(l+r, end="", flush=True)
-        desiredspace = c.space(l,r)
-        currentspace = rsbs[l] + lsbs[r]
-        kernvalue = desiredspace - currentspace
         if abs(kernvalue) > 5:
             print("("+str(kernvalue)+")", end="", flush=True)
-            ttfont["kern"].kernTables[0][l,r] = kernvalue
         print(" ", end="", flush=True)
+    if args.classes:
+        matrix, left_classes, right_classes, exceptions = c.class_space_matrix(string.ascii_uppercase, string.ascii_uppercase, workers=args.workers, callback=kern)
+        print("\n%i left classes, %i right classes, %i exceptions" % (len(left_classes), len(right_classes), len(exceptions)))
+    else:
+        pairs = [(l, r) for l in string.ascii_uppercase for r in string.ascii_uppercase if not (l, r) in journal.kerns]
+        kerns, report = c.kern_pairs(pairs, journal.sidebearings, threshold=5, workers=args.workers, callback=kern)
+        print("\n%i pairs spaced, %i skipped as unkerned" % (report["evaluated"], report["skipped"]))
+
+for g, (lsb, rsb) in journal.sidebearings.items():
+    set_sidebearings(g, lsb, rsb)
+for (l, r), (desiredspace, kernvalue) in journal.kerns.items():
+    if abs(kernvalue) > 5:
+        ttfont["kern"].kernTables[0][l,r] = kernvalue
+
+if args.fea:
+    print("\nWriting "+args.fea)
+    with open(args.fea, "w") as f:
+        f.write(journal.feature_file(threshold=5))
 
 print("\nSaving "+spaced_filename)
 ttfont.save(spaced_filename)
+if not journal.complete:
+    journal.mark_complete()
+journal.close()
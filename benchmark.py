@@ -0,0 +1,342 @@
+# Times CounterSpace on fonts generated on the spot, so that it can be run
+# without a network connection, and writes the results as JSON so that
+# runs on different commits can be compared.
+from CounterSpace import CounterSpace
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from fontTools.fontBuilder import FontBuilder
+from fontTools.misc.timeTools import timestampFromString
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import newTable
+from fontTools.ttLib.tables._k_e_r_n import KernTable_format_0
+
+CAP_HEIGHT = 700
+X_HEIGHT = 500
+ASCENDER = 720
+DESCENDER = -200
+
+styles = {
+    "Sans": {"stem": 80, "serif": False, "slant": 0},
+    "Serif": {"stem": 70, "serif": True, "slant": 0},
+    "Italic": {"stem": 80, "serif": False, "slant": 12},
+}
+
+
+class Drawing(object):
+    """Builds up a glyph's outline from simple strokes, in the given style."""
+
+    def __init__(self, style):
+        self.s = style["stem"]
+        self.serif = style["serif"]
+        self.contours = []
+
+    def polygon(self, points):
+        area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]))
+        if area > 0: # TrueType outer contours go clockwise
+            points = points[::-1]
+        self.contours.append(points)
+
+    def rect(self, x0, y0, x1, y1):
+        self.polygon([(x0, y0), (x0, y1), (x1, y1), (x1, y0)])
+
+    def stem(self, x, y0, y1, serifs = True):
+        self.rect(x, y0, x + self.s, y1)
+        if self.serif and serifs:
+            for y in [y0, y1 - self.s // 2]:
+                self.rect(x - self.s // 2, y, x + self.s * 3 // 2, y + self.s // 2)
+
+    def bar(self, y, x0, x1):
+        self.rect(x0, y, x1, y + self.s * 3 // 4)
+
+    def diagonal(self, x0, y0, x1, y1):
+        w = self.s * 1.15
+        self.polygon([(x0, y0), (x0 + w, y0), (x1 + w, y1), (x1, y1)])
+
+    def arc(self, cx, cy, rx, ry, a0 = 0, a1 = 360, steps = 32):
+        angles = np.radians(np.linspace(a0, a1, steps + 1))
+        outer = [(cx + rx * math.cos(a), cy + ry * math.sin(a)) for a in angles]
+        inner = [(cx + (rx - self.s) * math.cos(a), cy + (ry - self.s * 3 // 4) * math.sin(a)) for a in angles]
+        if a1 - a0 >= 360:
+            # A closed ring: the counter runs the other way to the outside
+            self.polygon(outer[:-1])
+            self.contours.append(inner[:-1])
+        else:
+            self.polygon(outer + inner[::-1])
+
+
+def draw(d, g):
+    """Draws a rough rendition of the letter `g`."""
+    s, H, x, A, D = d.s, CAP_HEIGHT, X_HEIGHT, ASCENDER, DESCENDER
+    if g == "A":
+        d.diagonal(0, 0, 280, H); d.diagonal(560, 0, 280, H); d.bar(200, 120, 520)
+    elif g == "B":
+        d.stem(0, 0, H); d.bar(H - s * 3 // 4, 0, 300); d.bar(330, 0, 300); d.bar(0, 0, 320)
+        d.arc(300, 527, 200, 173, -90, 90); d.arc(320, 183, 220, 183, -90, 90)
+    elif g == "C":
+        d.arc(330, H / 2, 330, H / 2, 45, 315)
+    elif g == "D":
+        d.stem(0, 0, H); d.bar(0, 0, 250); d.bar(H - s * 3 // 4, 0, 250); d.arc(250, H / 2, 330, H / 2, -90, 90)
+    elif g == "E":
+        d.stem(0, 0, H); d.bar(0, 0, 480); d.bar(330, 0, 420); d.bar(H - s * 3 // 4, 0, 480)
+    elif g == "F":
+        d.stem(0, 0, H); d.bar(330, 0, 420); d.bar(H - s * 3 // 4, 0, 480)
+    elif g == "G":
+        d.arc(330, H / 2, 330, H / 2, 45, 330); d.bar(300, 360, 640); d.stem(640 - s, 100, 360, False)
+    elif g == "H":
+        d.stem(0, 0, H); d.stem(480, 0, H); d.bar(330, 0, 480 + s)
+    elif g == "I":
+        d.stem(0, 0, H)
+    elif g == "J":
+        d.stem(300, 200, H, False); d.arc(190, 200, 190 + s, 200, 180, 360)
+    elif g == "K":
+        d.stem(0, 0, H); d.diagonal(s, 300, 440, H); d.diagonal(480, 0, 140, 380)
+    elif g == "L":
+        d.stem(0, 0, H); d.bar(0, 0, 440)
+    elif g == "M":
+        d.stem(0, 0, H); d.stem(640, 0, H); d.diagonal(0, H, 300, 100); d.diagonal(640 - s * 0.15, H, 340, 100)
+    elif g == "N":
+        d.stem(0, 0, H); d.stem(520, 0, H); d.diagonal(0, H, 520 - s * 0.15, 0)
+    elif g == "O":
+        d.arc(350, H / 2, 350, H / 2)
+    elif g == "P":
+        d.stem(0, 0, H); d.bar(H - s * 3 // 4, 0, 280); d.bar(300, 0, 280); d.arc(280, 510, 230, 190, -90, 90)
+    elif g == "Q":
+        d.arc(350, H / 2, 350, H / 2); d.diagonal(380, 160, 600, -120)
+    elif g == "R":
+        d.stem(0, 0, H); d.bar(H - s * 3 // 4, 0, 280); d.bar(300, 0, 280); d.arc(280, 510, 230, 190, -90, 90)
+        d.diagonal(200, 340, 440, 0)
+    elif g == "S":
+        d.arc(270, 527, 250, 173, 20, 270); d.arc(270, 183, 250, 183, -200, 90)
+    elif g == "T":
+        d.bar(H - s * 3 // 4, 0, 560); d.stem(280 - s // 2, 0, H, False)
+    elif g == "U":
+        d.stem(0, 240, H, False); d.stem(480, 240, H, False); d.arc(240 + s // 2, 240, 240 + s // 2, 240, 180, 360)
+    elif g == "V":
+        d.diagonal(0, H, 270, 0); d.diagonal(540, H, 270, 0)
+    elif g == "W":
+        d.diagonal(0, H, 200, 0); d.diagonal(400, H, 200, 0); d.diagonal(400, H, 600, 0); d.diagonal(800, H, 600, 0)
+    elif g == "X":
+        d.diagonal(0, H, 500, 0); d.diagonal(500, H, 0, 0)
+    elif g == "Y":
+        d.diagonal(0, H, 270, 330); d.diagonal(540, H, 270, 330); d.stem(270, 0, 340)
+    elif g == "Z":
+        d.bar(0, 0, 520); d.bar(H - s * 3 // 4, 0, 500); d.diagonal(0, s, 500 - s, H - s)
+    elif g in "ao":
+        d.arc(250, x / 2, 250, x / 2)
+        if g == "a": d.stem(500 - s, 0, x)
+    elif g in "bdpq":
+        d.arc(280 if g in "bp" else 250, x / 2, 250, x / 2)
+        stem_x = 0 if g in "bp" else 500 - s
+        d.stem(stem_x, 0, A) if g in "bd" else d.stem(stem_x, D, x)
+    elif g == "c":
+        d.arc(250, x / 2, 250, x / 2, 45, 315)
+    elif g == "e":
+        d.arc(250, x / 2, 250, x / 2, 0, 320); d.bar(x / 2 - s / 2, 0, 500)
+    elif g == "f":
+        d.stem(60, 0, A - 100); d.bar(x - s * 3 // 4, 0, 260); d.arc(220, A - 100, 160 + s // 2, 100, 0, 180)
+    elif g == "g":
+        d.arc(250, x / 2 + 50, 250, x / 2 - 50); d.stem(500 - s, 0, x, False); d.arc(250, 0, 250, 200, 200, 360)
+    elif g in "hmnr":
+        d.stem(0, 0, A if g == "h" else x)
+        arches = 2 if g == "m" else 1
+        for i in range(arches):
+            left = i * 280
+            if g == "r":
+                d.arc(left + 180, x - 150, 180, 150, 30, 180)
+            else:
+                d.arc(left + 140 + s // 2, x - 150, 140 + s // 2, 150, 0, 180); d.stem(left + 280, 0, x - 150)
+    elif g in "ij":
+        d.stem(0, 0 if g == "i" else D, x); d.rect(0, x + 80, s, x + 80 + s)
+    elif g == "k":
+        d.stem(0, 0, A); d.diagonal(s, 180, 360, x); d.diagonal(380, 0, 120, 260)
+    elif g == "l":
+        d.stem(0, 0, A)
+    elif g == "s":
+        d.arc(200, 375, 190, 125, 20, 270); d.arc(200, 125, 190, 125, -200, 90)
+    elif g == "t":
+        d.stem(60, 0, A - 120, False); d.bar(x - s * 3 // 4, 0, 280)
+    elif g == "u":
+        d.stem(0, 150, x, False); d.stem(420, 0, x); d.arc(210 + s // 2, 150, 210 + s // 2, 150, 180, 360)
+    elif g == "v":
+        d.diagonal(0, x, 210, 0); d.diagonal(420, x, 210, 0)
+    elif g == "w":
+        d.diagonal(0, x, 160, 0); d.diagonal(320, x, 160, 0); d.diagonal(320, x, 480, 0); d.diagonal(640, x, 480, 0)
+    elif g == "x":
+        d.diagonal(0, x, 400, 0); d.diagonal(400, x, 0, 0)
+    elif g == "y":
+        d.diagonal(0, x, 210, 0); d.diagonal(420, x, 80, D)
+    elif g == "z":
+        d.bar(0, 0, 420); d.bar(x - s * 3 // 4, 0, 400); d.diagonal(0, s, 400 - s, x - s)
+
+
+def make_font(filename, style):
+    """Writes a TrueType font of A-Z and a-z in the given style to `filename`."""
+    letters = [chr(c) for c in range(ord("A"), ord("Z") + 1)] + [chr(c) for c in range(ord("a"), ord("z") + 1)]
+    slant = math.tan(math.radians(style["slant"]))
+    glyphs, metrics = {".notdef": TTGlyphPen(None).glyph()}, {".notdef": (500, 0)}
+    for g in letters:
+        d = Drawing(style)
+        draw(d, g)
+        points = [[(x + y * slant, y) for x, y in contour] for contour in d.contours]
+        xmin = min(x for contour in points for x, y in contour)
+        pen = TTGlyphPen(None)
+        for contour in points:
+            pen.moveTo((int(round(contour[0][0] - xmin + 50)), int(round(contour[0][1]))))
+            for px, py in contour[1:]:
+                pen.lineTo((int(round(px - xmin + 50)), int(round(py))))
+            pen.closePath()
+        glyphs[g] = pen.glyph()
+        width = max(x for contour in points for x, y in contour) - xmin
+        metrics[g] = (int(round(width)) + 100, 50)
+
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder([".notdef"] + letters)
+    fb.setupCharacterMap(dict((ord(g), g) for g in letters))
+    fb.setupGlyf(glyphs)
+    fb.setupHorizontalMetrics(metrics)
+    fb.setupHorizontalHeader(ascent=900, descent=-250)
+    fb.setupNameTable({"familyName": "CounterSpace Test", "styleName": style["name"]})
+    fb.setupOS2(sxHeight=X_HEIGHT, sCapHeight=CAP_HEIGHT, sTypoAscender=900, sTypoDescender=-250, usWinAscent=900, usWinDescent=250)
+    fb.setupPost(italicAngle=-style["slant"])
+    # autospace.py writes its kerning into the first kern subtable
+    kern = newTable("kern")
+    kern.version = 0
+    subtable = KernTable_format_0()
+    subtable.version, subtable.coverage, subtable.kernTable = 0, 1, {}
+    kern.kernTables = [subtable]
+    fb.font["kern"] = kern
+    # A fixed date, so that every run generates byte-for-byte the same font
+    created = timestampFromString("Mon Jan  1 00:00:00 2024")
+    fb.updateHead(created=created, modified=created)
+    fb.font.recalcTimestamp = False
+    fb.save(filename)
+
+
+def timings(times):
+    """The best and median of a list of times, as reported for each measurement."""
+    return {"time": min(times), "median_time": float(np.median(times)), "repeats": len(times)}
+
+
+def measure(prepare, f, repeats = 1):
+    """Returns `f(prepare())`, the time it took (the best and the median of `repeats`
+    runs, each on a freshly prepared argument) and the peak memory it allocated.
+    Tracing allocations slows everything down, so the peak memory is found by a
+    separate run, and the timed runs are timed alone."""
+    times = []
+    for _ in range(repeats):
+        arg = prepare()
+        started = time.perf_counter()
+        result = f(arg)
+        times.append(time.perf_counter() - started)
+    arg = prepare()
+    tracemalloc.start()
+    try:
+        f(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, dict(timings(times), peak_memory=peak)
+
+
+def benchmark_font(filename, args):
+    results = {}
+    serif_smoothing = 2 if "Serif" in filename else 0
+    def spacer(options = None):
+        # Each measurement starts from cold caches
+        s = CounterSpace(filename, serif_smoothing=serif_smoothing)
+        s.options = options
+        return s
+    options, results["determine_parameters"] = measure(spacer, lambda s: s.determine_parameters(), args.repeats)
+
+    pairs = [(l, r) for l in "HOAVTno" for r in "HOAVTno"]
+    if args.quick:
+        pairs = pairs[:12]
+    spacings, results["space"] = measure(lambda: spacer(options), lambda s: [s.space(l, r) for l, r in pairs], args.repeats)
+    results["space"]["pairs"] = len(pairs)
+
+    glyphs = "HOAVTW" if args.quick else "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    sidebearings, results["derive_sidebearings"] = measure(lambda: spacer(options), lambda s: [s.derive_sidebearings(g) for g in glyphs], args.repeats)
+    results["derive_sidebearings"]["glyphs"] = len(glyphs)
+
+    # Pyramid search, timed against bisection (each from cold) on the same pairs
+    results["pyramid"] = spacer(options).accuracy_report(pairs)
+
+    # Spacing results, so that changes in behaviour show up alongside changes in speed
+    results["spacings"] = dict((l + r, int(s)) for (l, r), s in zip(pairs, spacings))
+    return results
+
+
+def benchmark_autospace(filename, repeats = 1):
+    """Times complete runs of autospace.py on the font, each in a separate process,
+    reporting the best and median of `repeats` runs and the largest peak RSS."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "autospace.py")
+    command = [sys.executable, script, filename, "--no-cache", "--restart", "--journal", filename + ".journal"]
+    times, statuses, peaks = [], [], []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0) if hasattr(os, "wait4") else (None, process.wait(), None)
+        times.append(time.perf_counter() - started)
+        statuses.append(status)
+        if usage is not None:
+            # ru_maxrss is in kilobytes on Linux, bytes on macOS
+            peaks.append(usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024))
+    # A failed run is reported even if others succeeded
+    result = dict(timings(times), exit_status=next((s for s in statuses if s), 0))
+    if peaks:
+        result["peak_rss"] = max(peaks)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark CounterSpace on locally generated fonts")
+    parser.add_argument("--output", help="File to write the results to (default: standard output)")
+    parser.add_argument("--fonts", help="Directory in which to generate the test fonts (default: a temporary directory)")
+    parser.add_argument("--quick", action="store_true", help="Space fewer pairs and glyphs")
+    parser.add_argument("--no-autospace", action="store_true", help="Don't time a full autospace.py run")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of times to time each measurement, reporting the best and median (default: 5)")
+    args = parser.parse_args()
+
+    fontdir = args.fonts or tempfile.mkdtemp(prefix="counterspace-benchmark-")
+    if not os.path.isdir(fontdir):
+        os.makedirs(fontdir)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "fonts": {},
+    }
+    for name, style in sorted(styles.items()):
+        style = dict(style, name=name)
+        filename = os.path.join(fontdir, "CounterSpaceTest-%s.ttf" % name)
+        make_font(filename, style)
+        print("Benchmarking %s..." % name, file=sys.stderr)
+        report["fonts"][name] = benchmark_font(filename, args)
+        if not args.no_autospace and not args.quick:
+            report["fonts"][name]["autospace"] = benchmark_autospace(filename, args.repeats)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
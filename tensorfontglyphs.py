@@ -5,11 +5,15 @@
 
 # sudo /usr/bin/easy_install scikit-image<0.15 numpy 
 import numpy as np
-from AppKit import NSBitmapImageRep, NSGraphicsContext, NSCalibratedWhiteColorSpace, NSPNGFileType,NSColor,NSBezierPath,NSMakeRect,NSAffineTransform
+try:
+  from AppKit import NSBitmapImageRep, NSGraphicsContext, NSCalibratedWhiteColorSpace, NSPNGFileType,NSColor,NSBezierPath,NSMakeRect,NSAffineTransform
+except ImportError:
+  # Only needed to render glyphs inside Glyphs; tensorfontheadless renders
+  # them elsewhere, and shares the rest of this module.
+  pass
 import math
 
 from skimage.transform import resize
-from skimage.util import pad
 from skimage import filters
 from skimage.morphology import convex_hull_image
 
@@ -66,6 +70,7 @@ class Font(object):
     """The ascender-to-descender ratio."""
 
     self.glyphcache = {}
+    self.contourcache = {}
     self.kernreader = None
 
   def get_xheight(self):
@@ -78,8 +83,9 @@ class Font(object):
   def glyph(self, g):
     """Access a glyph by name. Returns a `Glyph` object."""
     if g in self.glyphcache: return self.glyphcache[g]
-    self.glyphcache[g] = Glyph(self,g)
-    return self.glyphcache[g]
+    result = Glyph(self,g)
+    self.glyphcache[g] = result
+    return result
 
   @property
   def m_width(self):
@@ -107,21 +113,46 @@ class Font(object):
       distance = distance + self.pair_kerning(left, right)
     return distance
 
+  def contours(self, g):
+    """Returns the left and right contours of a glyph (see `GlyphRendering.left_contour`),
+    along with a mask of the scanlines which have no ink. These are computed once
+    per glyph, so that ink distances don't need the glyph to be rendered again."""
+    if g in self.contourcache: return self.contourcache[g]
+    matrix = self.glyph(g).as_matrix()
+    blank = matrix.left_contour(max_depth=-1) == -1
+    result = (matrix.left_contour(max_depth=0), matrix.right_contour(max_depth=0), blank)
+    self.contourcache[g] = result
+    return result
+
+  def ink_distance_matrix(self, lefts, rights):
+    """Returns two matrices, of shape `len(lefts)` x `len(rights)`, holding the
+    minimum and maximum ink distances (see `minimum_ink_distance` and
+    `maximum_ink_distance`) of every pair of a left glyph and a right glyph."""
+    def stack(glyphs, side):
+      contours = [self.contours(g) for g in glyphs]
+      return np.array([c[side] for c in contours]), np.array([c[2] for c in contours])
+    right_of_l, l_blank = stack(lefts, 1)
+    left_of_r, r_blank = stack(rights, 0)
+    distances = right_of_l[:,np.newaxis,:] + left_of_r[np.newaxis,:,:]
+    l_blank = l_blank[:,np.newaxis,:]
+    r_blank = r_blank[np.newaxis,:,:]
+    minimum = np.min(distances + 10000 * l_blank + 10000 * r_blank, axis=2)
+    maximum = np.max(distances - l_blank - r_blank, axis=2)
+    return minimum, maximum
+
   def minimum_ink_distance(self,left,right):
     """The distance, in pixels, between the ink of the left glyph and the ink of the right glyph, when
     sidebearings are discarded. For many pairs, this will be zero, as the shapes bump up against
     each other (consider "nn" and "oo"). However, pairs like "VA" and "xT" will have a large
     minimum ink distance."""
-    right_of_l = self.glyph(left).as_matrix().right_contour()
-    left_of_r  = self.glyph(right).as_matrix().left_contour()
-    return np.min(right_of_l + left_of_r)
+    left_of_l, right_of_l, l_blank = self.contours(left)
+    left_of_r, right_of_r, r_blank = self.contours(right)
+    return np.min(right_of_l + left_of_r + 10000 * l_blank + 10000 * r_blank)
 
   def maximum_ink_distance(self,left,right):
     """The maximum distance, in pixels, between the ink of the left glyph and the ink of the right glyph, when
     sidebearings are discarded. In other words, the size of the "hole" in the glyph (LV has a large hole)."""
-    right_of_l = self.glyph(left).as_matrix().right_contour(max_depth = -1)
-    left_of_r  = self.glyph(right).as_matrix().left_contour(max_depth = -1)
-    return np.max(right_of_l + left_of_r)
+    return self.ink_distance_matrix([left], [right])[1][0,0]
 
   def shift_distances(self,l,r,dist):
     """Returns two distances, for which the left glyph matrix and the right glyph matrix
@@ -130,13 +161,14 @@ class Font(object):
 
     (Inputs `l` and `r` are glyph names, not `GlyphRendering` objects.)
     """
-    sample_distance = dist + self.minimum_ink_distance(l,r)
+    minimum_ink_distance = self.minimum_ink_distance(l,r)
+    sample_distance = dist + minimum_ink_distance
     sample_distance_left = np.ceil(sample_distance / 2.0)
     sample_distance_right = np.floor(sample_distance / 2.0)
     total_ink_width = self.glyph(l).ink_width + self.glyph(r).ink_width
     ink_width_left = np.floor(total_ink_width / 4.0)
     ink_width_right = np.ceil(total_ink_width / 4.0)
-    total_width_at_minimum_ink_distance = total_ink_width - self.minimum_ink_distance(l, r)
+    total_width_at_minimum_ink_distance = total_ink_width - minimum_ink_distance
     left_translation = (-(np.ceil(total_width_at_minimum_ink_distance/2.0) + sample_distance_left) - (-ink_width_left))
     right_translation = ((np.floor(total_width_at_minimum_ink_distance/2.0) + sample_distance_right) - ink_width_right)
     return left_translation,right_translation
@@ -212,8 +244,6 @@ class Glyph(object):
     p2.transformUsingAffineTransform_(t)
     p2.fill()
 
-    png = b.representationUsingType_properties_(NSPNGFileType,None)
-    png.writeToFile_atomically_("/tmp/foo.png", False)
     Z = np.array(b.bitmapData())
     box_width_up = Z.shape[0]/box_height
     Z = Z.reshape((box_height,box_width_up))[0:box_height,0:box_width]
@@ -226,23 +256,39 @@ class Glyph(object):
 
 class GlyphRendering(np.ndarray):
   @classmethod
-  def init_from_numpy(self, glyph, matrix):
-    s = GlyphRendering(matrix.shape)
-    s[:] = matrix
+  def init_from_numpy(self, glyph, matrix, compact = False):
+    """Wraps a matrix as a `GlyphRendering` of the given glyph. The matrix's buffer is
+    shared, not copied, unless its type has to change: normally renderings are `float64`,
+    but `compact` ones keep binary masks as `bool` or `uint8` and store greyscale as
+    `float32`. Renderings derived from a compact one are compact too."""
+    matrix = np.asarray(matrix)
+    if not compact:
+      matrix = matrix.astype(np.float64, copy=False)
+    elif matrix.dtype != np.bool_ and matrix.dtype != np.uint8:
+      matrix = matrix.astype(np.float32, copy=False)
+    s = matrix.view(GlyphRendering)
     s._glyph = glyph
+    s._compact = compact
     return s
 
+  def compacted(self):
+    """Returns the rendering as a compact `GlyphRendering` (see `init_from_numpy`)."""
+    return GlyphRendering.init_from_numpy(self._glyph, self, compact=True)
+
+  def _derived(self, matrix):
+    return GlyphRendering.init_from_numpy(self._glyph, matrix, compact=getattr(self, "_compact", False))
+
   def with_padding(self, left_padding, right_padding):
     """Returns a new `GlyphRendering` object, left and right zero-padding to the glyph image."""
     padding = ((0,0),(left_padding, right_padding))
-    padded = pad(self, padding, "constant")
-    return GlyphRendering.init_from_numpy(self._glyph, padded)
+    padded = np.pad(self, padding, "constant")
+    return self._derived(padded)
 
   def with_padding_to_constant_box_width(self, box_width):
     padding_width = (box_width - int(self._glyph.ink_width)) / 2.0
     padding = ((0, 0), (int(np.ceil(padding_width)), int(np.floor(padding_width))))
-    padded = pad(self, padding, "constant")
-    return GlyphRendering.init_from_numpy(self._glyph, padded)
+    padded = np.pad(self, padding, "constant")
+    return self._derived(padded)
 
   def with_sidebearings(self):
     """Returns a new `GlyphRendering` object, extending the image to add the
@@ -252,35 +298,37 @@ class GlyphRendering(np.ndarray):
     rsb = self._glyph.rsb
     matrix = self
     if lsb < 0:
-        matrix = GlyphRendering.init_from_numpy(self._glyph,self[:,-lsb:])
+        matrix = self._derived(self[:,-lsb:])
         lsb = 0
     if rsb < 0:
-        matrix = GlyphRendering.init_from_numpy(self._glyph,self[:,:rsb])
+        matrix = self._derived(self[:,:rsb])
         rsb = 0
     return matrix.with_padding(lsb,rsb)
 
   def mask_to_x_height(self):
     """Returns a new `GlyphRendering` object, cropping the glyph image
-    from the baseline to the x-height. (Assuming that the input `GlyphRendering` is full height.)"""
+    from the baseline to the x-height. (Assuming that the input `GlyphRendering` is full height.)
+    The result is a view of this rendering."""
     f = self._glyph.font
     baseline = int(f.full_height + f.descender)
     top = int(baseline - f.x_height)
     cropped = self[top:baseline,:]
-    return GlyphRendering.init_from_numpy(self._glyph, cropped)
+    return self._derived(cropped)
 
   def crop_descender(self):
     """Returns a new `GlyphRendering` object, cropping the glyph image
-    from the baseline to the ascender. (Assuming that the input `GlyphRendering` is full height.)"""
+    from the baseline to the ascender. (Assuming that the input `GlyphRendering` is full height.)
+    The result is a view of this rendering."""
     f = self._glyph.font
     baseline = int(f.full_height + f.descender)
     cropped = self[:baseline,:]
-    return GlyphRendering.init_from_numpy(self._glyph, cropped)
+    return self._derived(cropped)
 
   def scale_to_height(self, height):
     """Returns a new `GlyphRendering` object, scaling the glyph image to the
     given height. (The new width is calculated proportionally.)"""
     new_width = int(self.shape[1] * height / self.shape[0])
-    return GlyphRendering.init_from_numpy(self._glyph, resize(self, (height, new_width), mode="constant"))
+    return self._derived(resize(self, (height, new_width), mode="constant"))
 
   def left_contour(self, cutoff = 30, max_depth = 10000):
     """Returns the left contour of the matrix; ie, the 'sidebearing array' from the
@@ -300,7 +348,7 @@ class GlyphRendering(np.ndarray):
   def apply_flexible_distance_kernel(self, strength):
     """Transforms the matrix by applying a flexible distance kernel, with given strength."""
     transformed = 1. - np.clip(strength-ndimage.distance_transform_edt(np.logical_not(self)),0,strength)
-    return GlyphRendering.init_from_numpy(self._glyph,transformed)
+    return self._derived(transformed)
 
   def gradients(self):
     """Returns a pair of images representing the horizontal and vertical gradients."""
@@ -327,31 +375,35 @@ class GlyphRendering(np.ndarray):
     and zero values elsewhere, and the second has positive values between the right-hand contour and
     the right edge of the matrix and zero values elsewhere. In other words this gives you the
     "white" at the edge of the glyph, without any interior counters."""
-    def last_nonzero(arr, axis, invalid_val=-1):
-        mask = arr > 5/255.0
-        val = arr.shape[axis] - np.flip(mask, axis=axis).argmax(axis=axis) - 1
-        return np.where(mask.any(axis=axis), val, invalid_val)
-
-    def first_zero(arr, axis, invalid_val=-1):
-        mask = arr < 5/255.0
-        val = mask.argmax(axis=axis) - 1
-        return np.where(mask.any(axis=axis), val, invalid_val)
+    return [self._derived(x) for x in GlyphRendering.edge_masks(self)]
+
+  @staticmethod
+  def edge_masks(images):
+    """The batched form of `mask_ink_to_edge`. Takes an image, or a stack of images
+    (the last two axes being rows and columns), and returns plain arrays of the same
+    shape holding their left and right edges."""
+    images = np.asarray(images)
+    if images.dtype == np.bool_:
+      images = images.view(np.uint8)
+    columns = np.arange(images.shape[-1])
 
     def left_counter(image):
         lcounter = 1 - image
-        lnonz = first_zero(lcounter,1)
-        for x in range(lnonz.shape[0]): lcounter[x,1+lnonz[x]:] = 0
-        lcounter -= np.min(lcounter)
-        for x in range(lnonz.shape[0]): lcounter[x,lnonz[x]:] = 0
+        mask = lcounter < 5/255.0
+        # The column before the first ink on each row; -1 if there is none
+        lnonz = np.where(mask.any(axis=-1), mask.argmax(axis=-1) - 1, -1)[...,np.newaxis]
+        lcounter[columns >= 1 + lnonz] = 0
+        lcounter -= np.min(lcounter, axis=(-2,-1), keepdims=True)
+        lcounter[columns >= np.where(lnonz < 0, image.shape[-1] + lnonz, lnonz)] = 0
         return lcounter
 
     def right_counter(image):
-        rcounter = np.flip(image,axis=1)
+        rcounter = np.flip(image,axis=-1)
         rcounter = left_counter(rcounter)
-        rcounter = np.flip(rcounter,axis=1)
+        rcounter = np.flip(rcounter,axis=-1)
         return rcounter
 
-    return [GlyphRendering.init_from_numpy(self._glyph,x) for x in [left_counter(self), right_counter(self)]]
+    return left_counter(images), right_counter(images)
 
   def discontinuity(self, contour="left", tolerance = 0.05):
     """Provides a measure, from zero to one, of the "jumpiness" or discontinuity of a
@@ -388,21 +440,27 @@ class GlyphRendering(np.ndarray):
     glyph and its convex hull."""
 
     ch = GlyphRendering.init_from_numpy(self,convex_hull_image(self))
+    width = self.shape[1]
+    new = np.array(self)
+    fill = np.max(new)
+
     r = self.left_contour(max_depth=-1)
     rch = ch.left_contour(cutoff=0.1,max_depth=-1)
     interpolated = (rch * (percent) + r * (1-percent)).astype(np.int32)
-    new = GlyphRendering.init_from_numpy(self,self.copy())
-    fill = np.max(new)
-    for line in range(0,len(interpolated)):
-        if interpolated[line] != -1:
-            new[line,interpolated[line]:r[line]+1] = fill
+    new[slice_mask(interpolated, r+1, width) & (interpolated != -1)[:,np.newaxis]] = fill
 
     r = self.right_contour(max_depth=-1)
     rch = ch.right_contour(cutoff=0.1,max_depth=-1)
-    width = self.shape[1]
     interpolated = (rch * (percent) + r * (1-percent)).astype(np.int32)
-    for line in range(0,len(interpolated)):
-        if interpolated[line] != -1:
-            new[line,(width-r[line]+1):(width-interpolated[line])] = fill
-
-    return GlyphRendering.init_from_numpy(self._glyph,new)
\ No newline at end of file
+    new[slice_mask(width-r+1, width-interpolated, width) & (interpolated != -1)[:,np.newaxis]] = fill
+
+    return self._derived(new)
+
+def slice_mask(starts, stops, width):
+  """Returns a boolean matrix with a row for each element of `starts` and `stops`,
+  which is true in the columns `row[start:stop]` would select from a row `width`
+  columns wide (following Python's rules for negative indices)."""
+  def normalize(index):
+    return np.where(index < 0, np.maximum(index + width, 0), np.minimum(index, width))[:,np.newaxis]
+  columns = np.arange(width)
+  return (columns >= normalize(starts)) & (columns < normalize(stops))
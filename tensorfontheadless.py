@@ -0,0 +1,278 @@
+# A headless drop-in for the `tensorfont` Font/Glyph classes, for running
+# CounterSpace where neither Glyphs nor freetype rendering is available.
+# Outlines are read with fontTools pens and scan-converted with numpy.
+import numpy as np
+
+from fontTools.ttLib import TTFont
+from fontTools.pens.basePen import BasePen
+from fontTools.pens.boundsPen import BoundsPen
+
+import tensorfontglyphs
+from tensorfontglyphs import GlyphRendering
+
+
+class EdgePen(BasePen):
+  """A pen which flattens an outline into a list of straight edges
+  `(x0, y0, x1, y1)`, transforming each point with `transform`."""
+
+  def __init__(self, glyphSet, transform, segments = 8):
+    BasePen.__init__(self, glyphSet)
+    self.transform = transform
+    self.segments = segments
+    self.edges = []
+    self.start = None
+    self.current = None
+
+  def _points_to(self, points):
+    points = [self.transform(p) for p in points]
+    start = self.current
+    for p in points:
+      self.edges.append((start[0], start[1], p[0], p[1]))
+      start = p
+    self.current = points[-1]
+
+  def _moveTo(self, p):
+    self.start = self.current = self.transform(p)
+
+  def _lineTo(self, p):
+    self.edges.append(self.current + self.transform(p))
+    self.current = self.transform(p)
+
+  def _curveToOne(self, p1, p2, p3):
+    p0 = self._getCurrentPoint()
+    t = np.linspace(0, 1, self.segments + 1)[1:, np.newaxis]
+    pts = ((1-t)**3 * p0 + 3*(1-t)**2*t * np.array(p1) + 3*(1-t)*t**2 * np.array(p2) + t**3 * np.array(p3))
+    self._points_to([tuple(p) for p in pts])
+
+  def _qCurveToOne(self, p1, p2):
+    p0 = self._getCurrentPoint()
+    t = np.linspace(0, 1, self.segments + 1)[1:, np.newaxis]
+    pts = ((1-t)**2 * p0 + 2*(1-t)*t * np.array(p1) + t**2 * np.array(p2))
+    self._points_to([tuple(p) for p in pts])
+
+  def _closePath(self):
+    if self.current != self.start:
+      self.edges.append(self.current + self.start)
+    self.current = self.start
+
+  _endPath = _closePath
+
+
+def rasterize(edges, width, height, oversample = 16):
+  """Scan-converts a list of edges (in pixel coordinates, y pointing down) into
+  a `height` x `width` array of 0-255 greyscale coverage values, using the non-zero
+  winding rule. Coverage is measured on an `oversample` x `oversample` grid of
+  samples within each pixel."""
+  image = np.zeros((height, width))
+  if len(edges) == 0 or width <= 0 or height <= 0:
+    return image
+  x0, y0, x1, y1 = np.array(edges, dtype=float).T
+  sloped = y0 != y1
+  x0, y0, x1, y1 = x0[sloped], y0[sloped], x1[sloped], y1[sloped]
+  direction = np.where(y1 > y0, 1, -1)
+  top, bottom = np.minimum(y0, y1), np.maximum(y0, y1)
+
+  samples_y = (np.arange(height * oversample) + 0.5) / oversample
+  columns = width * oversample
+  rows, edge = np.nonzero((samples_y[:, np.newaxis] >= top) & (samples_y[:, np.newaxis] < bottom))
+  crossing = x0[edge] + (samples_y[rows] - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+  # Each crossing changes the winding number of every sample to its right
+  first = np.clip(np.floor(crossing * oversample - 0.5).astype(int) + 1, 0, columns)
+  winding = np.zeros((height * oversample, columns + 1), dtype=int)
+  np.add.at(winding, (rows, first), direction[edge])
+  inside = np.cumsum(winding, axis=1)[:, :columns] != 0
+  coverage = inside.reshape(height, oversample, width, oversample).mean(axis=(1,3))
+  return np.round(coverage * 255)
+
+
+class Font(tensorfontglyphs.Font):
+  """A `Font` read from an OpenType file with fontTools, with the same interface
+  as `tensorfont.Font`."""
+
+  def __init__(self, filename, x_height_in_px = None):
+    self.filename = filename
+    self.ttfont = TTFont(filename)
+    self.glyphset = self.ttfont.getGlyphSet()
+    self.cmap = self.ttfont.getBestCmap() or {}
+    self.units_per_em = self.ttfont["head"].unitsPerEm
+
+    if x_height_in_px is None:
+      self.scale_factor = 1
+    else:
+      self.scale_factor = x_height_in_px / float(self.get_xheight())
+    # As with freetype, we render at a whole number of pixels per em
+    self.render_scale = int(self.units_per_em * self.scale_factor) / float(self.units_per_em)
+
+    self.ascender = self.ttfont["hhea"].ascent
+    self.ascender_px = int(self.ascender * self.scale_factor)
+    """The font's ascender height, in font units and pixels."""
+
+    self.descender = self.ttfont["hhea"].descent
+    self.descender_px = int(self.descender * self.scale_factor)
+    """The font's descender height, in font units and pixels (usually negative)."""
+
+    self.full_height = self.ascender - self.descender
+    self.full_height_px = self.ascender_px - self.descender_px
+    """The font's full (descender + ascender) height, in font units and pixels."""
+
+    self.baseline_ratio = 1 - (self.ascender) / float(self.full_height)
+    """The ascender-to-descender ratio."""
+
+    self.glyphcache = {}
+    self.contourcache = {}
+    self.renderingcache = {}
+    self.kernreader = None
+
+  def glyph_name(self, g):
+    """Glyphs may be given as characters or as glyph names."""
+    if len(g) == 1 and ord(g) in self.cmap:
+      return self.cmap[ord(g)]
+    if g in self.glyphset:
+      return g
+    raise KeyError("Glyph %s not found in %s" % (g, self.filename))
+
+  def get_xheight(self):
+    pen = BoundsPen(self.glyphset)
+    self.glyphset[self.glyph_name("x")].draw(pen)
+    return int(np.ceil(pen.bounds[3]) - np.floor(pen.bounds[1]))
+
+  def glyph(self, g):
+    """Access a glyph by name. Returns a `Glyph` object."""
+    if g in self.glyphcache: return self.glyphcache[g]
+    result = Glyph(self,g)
+    self.glyphcache[g] = result
+    return result
+
+  def is_rendered(self, g):
+    """Whether the glyph's rendering is already cached, so `as_matrix` won't render it again."""
+    holds = getattr(self.renderingcache, "holds", self.renderingcache.__contains__)
+    return holds((g, False, False))
+
+  @property
+  def face(self):
+    """Stands in for tensorfont's freetype face; only `units_per_EM` is provided."""
+    return Face(self.units_per_em)
+
+  @property
+  def italic_angle(self):
+    """The italic angle of the font, in degrees."""
+    return -(self.ttfont["post"].italicAngle)
+
+  def pair_kerning(self, left, right):
+    """The kerning between two glyphs (specified by name), in font units."""
+    if self.kernreader is None:
+      self.kernreader = KernReader(self.ttfont)
+    return self.kernreader.kerning(self.glyph_name(left), self.glyph_name(right)) * self.scale_factor
+
+
+class Face(object):
+  """The parts of a freetype face that callers of `Font.face` use."""
+
+  def __init__(self, units_per_EM):
+    self.units_per_EM = units_per_EM
+
+
+class KernReader(object):
+  """Looks up pair kerning from the `kern` table or from GPOS pair
+  adjustment lookups (formats 1 and 2)."""
+
+  def __init__(self, ttfont):
+    self.pairs = {}
+    self.class_subtables = []
+    if "kern" in ttfont:
+      for table in ttfont["kern"].kernTables:
+        if hasattr(table, "kernTable"):
+          self.pairs.update(table.kernTable)
+    if "GPOS" in ttfont and ttfont["GPOS"].table.LookupList:
+      for lookup in ttfont["GPOS"].table.LookupList.Lookup:
+        for subtable in lookup.SubTable:
+          if lookup.LookupType == 9:
+            subtable = subtable.ExtSubTable
+          if subtable.LookupType != 2:
+            continue
+          if subtable.Format == 1:
+            for first, pairset in zip(subtable.Coverage.glyphs, subtable.PairSet):
+              for record in pairset.PairValueRecord:
+                value = getattr(record.Value1, "XAdvance", 0) or 0
+                self.pairs.setdefault((first, record.SecondGlyph), value)
+          elif subtable.Format == 2:
+            self.class_subtables.append(subtable)
+
+  def kerning(self, left, right):
+    if (left, right) in self.pairs:
+      return self.pairs[(left, right)]
+    for subtable in self.class_subtables:
+      if not left in subtable.Coverage.glyphs:
+        continue
+      class1 = subtable.ClassDef1.classDefs.get(left, 0)
+      class2 = subtable.ClassDef2.classDefs.get(right, 0)
+      record = subtable.Class1Record[class1].Class2Record[class2]
+      value = getattr(record.Value1, "XAdvance", 0) or 0
+      if value:
+        return value
+    return 0
+
+
+class Glyph(object):
+  """A representation of a glyph and its metrics. As with `tensorfont`, the
+  metrics are measured in pixels at the font's rendering size."""
+  def __init__(self, font, g):
+    self.font = font
+    self.name = g
+    """The name of the glyph."""
+
+    glyphname = font.glyph_name(g)
+    self.outline = font.glyphset[glyphname]
+    scale = font.render_scale
+    pen = BoundsPen(font.glyphset)
+    self.outline.draw(pen)
+    if pen.bounds is None:
+      xmin = ymin = xmax = ymax = 0
+    else:
+      xmin, ymin, xmax, ymax = [b * scale for b in pen.bounds]
+    self.bitmap_left = int(np.floor(xmin))
+    self.bitmap_top  = int(np.ceil(ymax))
+
+    self.ink_width = int(np.ceil(xmax)) - self.bitmap_left
+    self.ink_height= self.bitmap_top - int(np.floor(ymin))
+    self.width     = self.outline.width * scale
+    """The width of the glyph in font units (including sidebearings)."""
+    self.height    = (ymax - ymin)
+    """The height of the glyph in font units."""
+    self.lsb       = self.bitmap_left
+    """The left sidebearing in font units."""
+    self.rsb       = int(round(self.width)) - self.ink_width - self.lsb
+    """The right sidebearing in font units."""
+    self.tsb       = self.font.ascender_px - self.bitmap_top
+    """The top sidebearing (distance from ascender to ink top) in font units."""
+
+  def rasterize(self):
+    """Returns the glyph's ink as an `ink_height` x `ink_width` array of 0-255 greyscale values."""
+    scale = self.font.render_scale
+    def transform(p):
+      return (p[0] * scale - self.bitmap_left, self.bitmap_top - p[1] * scale)
+    pen = EdgePen(self.font.glyphset, transform)
+    self.outline.draw(pen)
+    return rasterize(pen.edges, self.ink_width, self.ink_height)
+
+  def as_matrix(self, normalize = False, binarize = False):
+    """Renders the glyph as a matrix. By default, the matrix values are integer pixel greyscale values
+    in the range 0 to 255, but they can be normalized or turned into binary values with the
+    appropriate keyword arguments. The matrix is returned as a `GlyphRendering` object which
+    can be further manipulated. Renderings are kept in the font's `renderingcache`."""
+    key = (self.name, normalize, binarize)
+    if key in self.font.renderingcache: return self.font.renderingcache[key]
+    box_height = self.font.full_height_px
+    w, h = self.ink_width, self.ink_height
+    y = max(int(self.tsb), 0) # top-most row to draw on
+    visible_height = min(h, box_height - y) - max(-self.tsb, 0)
+
+    Z = np.zeros((box_height, w))
+    Z[y:y+visible_height, 0:w] += self.rasterize()[max(-self.tsb, 0):visible_height+max(-self.tsb, 0), :]
+    if normalize or binarize:
+      Z = Z / 255.0
+    if binarize:
+      Z = Z.astype(int)
+    result = GlyphRendering.init_from_numpy(self,Z)
+    self.font.renderingcache[key] = result
+    return result
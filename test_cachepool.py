@@ -0,0 +1,53 @@
+from CachePool import CachePool
+
+import unittest
+
+import numpy as np
+
+class TestCachePool(unittest.TestCase):
+
+  def test_1_storingAgainKeepsTheKey(self):
+    cache = CachePool().cache("test")
+    cache["a"] = np.zeros(10)
+    cache["a"] = np.ones(20)
+    self.assertIn("a", cache)
+    self.assertEqual(len(cache), 1)
+    self.assertEqual(cache["a"].sum(), 20)
+    self.assertEqual(cache.pool.bytes, np.ones(20).nbytes)
+
+  def test_2_budgetEvictsLeastRecentlyUsed(self):
+    size = np.zeros(10).nbytes
+    pool = CachePool(max_bytes = 4 * size)
+    first, second = pool.cache("first"), pool.cache("second")
+    for key in "abcd":
+      (first if key in "ab" else second)[key] = np.zeros(10)
+    first["a"]
+    second["e"] = np.zeros(10)
+    self.assertEqual(sorted(first.keys), ["a"])
+    self.assertEqual(sorted(second.keys), ["c","d","e"])
+    self.assertEqual(first.evictions, 1)
+    self.assertLessEqual(pool.bytes, pool.max_bytes)
+
+  def test_3_oversizedValuesDontFlushThePool(self):
+    size = np.zeros(10).nbytes
+    pool = CachePool(max_bytes = 8 * size)
+    cache = pool.cache("test")
+    for key in "abcd":
+      cache[key] = np.zeros(10)
+    cache["big"] = np.zeros(30)
+    self.assertNotIn("big", cache)
+    self.assertEqual(len(cache), 4)
+    self.assertEqual(cache.rejections, 1)
+    self.assertEqual(pool.bytes, 4 * size)
+
+  def test_4_maxEntriesEvictsLeastRecentlyUsed(self):
+    cache = CachePool().cache("test", max_entries = 3)
+    for key in "abc":
+      cache[key] = key
+    cache["a"]
+    cache["d"] = "d"
+    self.assertEqual(list(cache.keys), ["c","a","d"])
+    self.assertEqual(cache.evictions, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+from CounterSpace import CounterSpace, GlyphRendering, _init_worker, _space_pair
+from benchmark import make_font, styles
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import scipy.ndimage
+import scipy.signal
+
+# Unlike regression.py, these need no downloaded fonts: they run on the fonts
+# benchmark.py generates, and check that the faster ways of working things out
+# give the same results as the plain ones.
+options = { "h_center": 300, "w_center": 200, "h_top": 15, "w_top": 12, "h_bottom": 20, "w_bottom": 18, "top_strength": 0.3, "bottom_strength": 0.6, "center_strength": 1 }
+fontdir = None
+fonts = {}
+
+def setUpModule():
+  global fontdir
+  fontdir = tempfile.mkdtemp(prefix="counterspace-test-")
+  for name, style in sorted(styles.items()):
+    fonts[name] = os.path.join(fontdir, "CounterSpaceTest-%s.ttf" % name)
+    make_font(fonts[name], dict(style, name=name))
+
+def tearDownModule():
+  shutil.rmtree(fontdir)
+
+def spacer(name, **kwargs):
+  kwargs.setdefault("serif_smoothing", 2 if name == "Serif" else 0)
+  c = CounterSpace(fonts[name], **kwargs)
+  c.options = dict(options)
+  return c
+
+class TestEquivalence(unittest.TestCase):
+
+  def test_1_batchedAreasMatchSingleDistances(self):
+    for name in fonts:
+      c = spacer(name)
+      for l,r in ["HH","AV","no","To"]:
+        with self.subTest("Batched areas of %s%s for font %s" % (l,r,name)):
+          distances = list(range(-10, 60, 3))
+          batched = c.pair_areas(l, r, options, distances)
+          for d, area in zip(distances, batched):
+            self.assertEqual(area, c.pair_areas(l, r, options, [d])[0])
+            self.assertEqual(area, c.pair_areas(l, r, options, [d, d + 1], chunk_size = 1)[0])
+
+  def test_2_referencePairSpacedAgainstItself(self):
+    for name in fonts:
+      for reference in ["HH","nn"]:
+        with self.subTest("Reference pair %s for font %s" % (reference,name)):
+          l, r = reference
+          spacings = set()
+          for search in ["linear","bisect","pyramid"]:
+            c = spacer(name, search = search)
+            d = c.font.pair_distance(l, r)
+            # Measure around the pair's own distance first, so that the reference
+            # area is worked out with other distances already cached
+            c.pair_areas(l, r, options, np.arange(d - 5, d + 5))
+            self.assertEqual(c.pair_areas(l, r, options, [d])[0], c.reference_area(reference))
+            spacings.add(c.space(l, r))
+            self.assertEqual(spacer(name, search = search).space(l, r), c.space(l, r))
+          self.assertEqual(len(spacings), 1)
+
+  def test_3_pairAreaMatchesPairAreas(self):
+    for name in fonts:
+      c = spacer(name)
+      for l,r in ["HH","AV","no","To","OO"]:
+        with self.subTest("Areas of %s%s for font %s" % (l,r,name)):
+          for d in range(-10, 60, 7):
+            area = c.pair_areas(l, r, options, [d])[0]
+            self.assertAlmostEqual(np.sum(c.pair_area(l, r, options, d)), area, delta=1e-9 * max(area, 1))
+
+  def test_4_edgeProfilesMatchShiftedMasks(self):
+    for name in fonts:
+      c = spacer(name)
+      reftop, refbottom = c.reference_band("HH")
+      for g in "HAOn":
+        for side in ["left","right"]:
+          with self.subTest("Edge masks of the %s of %s for font %s" % (side,g,name)):
+            profile = c.edge_profile(g, side, reftop, refbottom)
+            padded = np.asarray(c.concavity_reduced(g, side, reftop, refbottom), dtype=float)
+            sliced = 0
+            for amount in range(-c.box_width, c.box_width, 9):
+              mask = profile.shifted(amount)
+              if mask is None: continue
+              sliced += 1
+              shifted = scipy.ndimage.shift(padded, (0,amount), mode="nearest")
+              left, right = GlyphRendering.init_from_numpy(g, shifted).mask_ink_to_edge()
+              expected = (right if side == "right" else left) > 0
+              self.assertTrue(np.array_equal(mask > 0, expected), "shifted by %i" % amount)
+            self.assertGreater(sliced, 0)
+
+  def test_5_convolutionMatchesScipy(self):
+    for name in fonts:
+      c = spacer(name, serif_smoothing = 2)
+      for g in "HAVOTnag":
+        with self.subTest("Serif smoothing of %s for font %s" % (g,name)):
+          image = np.asarray(c.rendering(g), dtype=float)
+          expected = scipy.signal.convolve(image, c.kernel, mode="same")
+          convolved = c.convolve_kernel(image)
+          self.assertTrue(np.allclose(convolved, expected, atol=1e-9 * np.max(np.abs(expected))))
+          self.assertTrue(np.array_equal(convolved > 250, expected > 250))
+
+  def test_6_compactGlyphsGiveTheSameResults(self):
+    for name in fonts:
+      c, compact = spacer(name), spacer(name, compact = True)
+      reftop, refbottom = c.reference_band("HH")
+      for g in "HAVOTn":
+        for side in ["left","right"]:
+          with self.subTest("Concavity of the %s of %s for font %s" % (side,g,name)):
+            reduced = np.asarray(c.concavity_reduced(g, side, reftop, refbottom), dtype=float)
+            compacted = np.asarray(compact.concavity_reduced(g, side, reftop, refbottom), dtype=float)
+            self.assertTrue(np.allclose(reduced, compacted, atol=1e-6))
+            self.assertTrue(np.array_equal(c.edge_profile(g, side, reftop, refbottom).canvas,
+              compact.edge_profile(g, side, reftop, refbottom).canvas))
+      for l,r in ["HH","AV","no","To"]:
+        with self.subTest("Compact spacing of %s%s for font %s" % (l,r,name)):
+          self.assertEqual(compact.space(l, r), c.space(l, r))
+
+  def test_7_gradientMatchesFiniteDifferences(self):
+    variables = ["h_center","w_center","h_top","w_top","top_strength","h_bottom","w_bottom","bottom_strength"]
+    for name in fonts:
+      c = spacer(name)
+      for l,r in ["HH","AV","no"]:
+        with self.subTest("Gradient of %s%s area for font %s" % (l,r,name)):
+          geometry = c.pair_geometry(l,r)
+          area, gradient = geometry.area_gradient(options, variables)
+          self.assertAlmostEqual(area, geometry.area(options), delta=1e-9 * area)
+          for ix, var in enumerate(variables):
+            step = 1e-5 * options[var]
+            up, down = dict(options), dict(options)
+            up[var] += step
+            down[var] -= step
+            estimate = (geometry.area(up) - geometry.area(down)) / (2 * step)
+            self.assertAlmostEqual(gradient[ix], estimate, delta=1e-5 * max(abs(estimate), 1e-3 * area))
+
+  def test_8_workersDontRenderTheGlyphs(self):
+    pairs = [("A","V"),("H","O"),("n","o"),("T","o")]
+    for name in fonts:
+      with self.subTest("Worker spacing for font %s" % name):
+        expected = [spacer(name, search = "bisect").space(l, r) for l, r in pairs]
+        c = spacer(name, search = "bisect")
+        state = c._worker_state(pairs)
+        with mock.patch.object(type(c.font.glyph("A")), "as_matrix", side_effect=AssertionError("a glyph was rendered")):
+          _init_worker(state)
+          self.assertEqual([_space_pair(pair)[2] for pair in pairs], expected)
+
+  def test_9_prescreenedKernsMatchSpacingEveryPair(self):
+    glyphs = "AHOTVno"
+    pairs = [(l, r) for l in glyphs for r in glyphs]
+    for name in fonts:
+      with self.subTest("Kerning with the prescreen for font %s" % name):
+        c = spacer(name)
+        sidebearings = dict((g, c.derive_sidebearings(g)) for g in glyphs)
+        kerns, report = c.kern_pairs(pairs, sidebearings, threshold = 5)
+        self.assertGreater(report["skipped"], 0)
+        full = spacer(name)
+        expected = {}
+        for l, r in pairs:
+          kern = full.space(l, r) - (sidebearings[l][1] + sidebearings[r][0])
+          if abs(kern) > 5:
+            expected[(l, r)] = kern
+        self.assertEqual(kerns, expected)
+
+  def test_10_classSpacingMatchesSpacingEveryPair(self):
+    glyphs = "HEFLIAVOnomu"
+    for name in fonts:
+      with self.subTest("Class spacing for font %s" % name):
+        matrix, left_classes, right_classes, exceptions = spacer(name).class_space_matrix(glyphs, glyphs)
+        self.assertLess(len(left_classes), len(glyphs))
+        self.assertLess(len(right_classes), len(glyphs))
+        self.assertTrue(np.array_equal(matrix, spacer(name).space_matrix(glyphs, glyphs)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+from CounterSpace import CounterSpace
+from SpacingStore import SpacingStore, ParameterStore
+from benchmark import make_font, styles
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fontTools.ttLib import TTFont
+
+# Checks that stored results are used again for an unchanged font, and not for
+# a font whose spacing has changed in a way which would change them. Like
+# test_equivalence.py, these run on the fonts benchmark.py generates.
+options = { "h_center": 300, "w_center": 200, "h_top": 15, "w_top": 12, "h_bottom": 20, "w_bottom": 18, "top_strength": 0.3, "bottom_strength": 0.6, "center_strength": 1 }
+fontdir = None
+fonts = {}
+
+def setUpModule():
+  global fontdir
+  fontdir = tempfile.mkdtemp(prefix="counterspace-test-")
+  for name, style in sorted(styles.items()):
+    fonts[name] = os.path.join(fontdir, "CounterSpaceTest-%s.ttf" % name)
+    make_font(fonts[name], dict(style, name=name))
+
+def tearDownModule():
+  shutil.rmtree(fontdir)
+
+def spacer(filename, **kwargs):
+  c = CounterSpace(filename, serif_smoothing=0, **kwargs)
+  c.options = dict(options)
+  return c
+
+def widened(glyph):
+  def edit(ttfont):
+    name = ttfont.getBestCmap()[ord(glyph)]
+    width, lsb = ttfont["hmtx"][name]
+    ttfont["hmtx"][name] = (width + 200, lsb)
+  return edit
+
+def slanted(ttfont):
+  ttfont["post"].italicAngle -= 6
+
+def edited(name, edit, suffix):
+  """A copy of one of the generated fonts, changed by `edit`."""
+  filename = os.path.join(fontdir, "CounterSpaceTest-%s-%s.ttf" % (name, suffix))
+  ttfont = TTFont(fonts[name])
+  edit(ttfont)
+  ttfont.save(filename)
+  return filename
+
+class TestStores(unittest.TestCase):
+
+  def test_1_spacingsMissOnlyWhenTheirInputsChange(self):
+    for name in fonts:
+      store = SpacingStore(os.path.join(fontdir, "%s.counterspace" % name))
+      c = spacer(fonts[name], store = store)
+      self.assertEqual(c.reference_pair("A","V"), "HH")
+      spacing = c.space("A","V")
+      key = c.spacing_key("A","V")
+
+      with self.subTest("Unchanged font %s hits the store" % name):
+        again = spacer(fonts[name], store = store)
+        again._space = lambda l, r: self.fail("%s%s was spaced again" % (l, r))
+        self.assertEqual(again.spacing_key("A","V"), key)
+        self.assertEqual(again.space("A","V"), spacing)
+
+      with self.subTest("Widening an unrelated glyph of %s hits the store" % name):
+        again = spacer(edited(name, widened("O"), "O"), store = store)
+        again._space = lambda l, r: self.fail("%s%s was spaced again" % (l, r))
+        self.assertEqual(again.space("A","V"), spacing)
+
+      for what, edit, suffix in [("the reference pair's spacing", widened("H"), "H"), ("the italic angle", slanted, "slanted")]:
+        with self.subTest("Changing %s of %s misses the store" % (what, name)):
+          changed = spacer(edited(name, edit, suffix), store = store)
+          if suffix == "H":
+            self.assertNotEqual(changed.font.pair_distance("H","H"), c.font.pair_distance("H","H"))
+          self.assertNotEqual(changed.spacing_key("A","V"), key)
+          self.assertIsNone(store.get(changed.spacing_key("A","V")))
+      store.close()
+
+  def test_2_parametersMissOnlyWhenTheirInputsChange(self):
+    for name in fonts:
+      store = ParameterStore(os.path.join(fontdir, "%s.parameters" % name))
+      c = spacer(fonts[name], parameter_store = store)
+      fitted = c.determine_parameters()
+      key = c.parameter_key()
+
+      for what, filename in [("Unchanged font %s" % name, fonts[name]),
+        ("Widening an unrelated glyph of %s" % name, edited(name, widened("n"), "n"))]:
+        with self.subTest("%s hits the store" % what):
+          again = spacer(filename, parameter_store = store)
+          again.pair_geometry = lambda l, r: self.fail("the parameters were fitted again")
+          self.assertEqual(again.parameter_key(), key)
+          self.assertEqual(again.determine_parameters(), fitted)
+
+      for what, edit, suffix in [("a key pair's spacing", widened("E"), "E"), ("the reference pair's spacing", widened("H"), "H"),
+        ("the italic angle", slanted, "slanted")]:
+        with self.subTest("Changing %s of %s misses the store" % (what, name)):
+          changed = spacer(edited(name, edit, suffix), parameter_store = store)
+          self.assertNotEqual(changed.parameter_key(), key)
+          self.assertIsNone(store.get(changed.parameter_key()))
+      store.close()
+
+if __name__ == '__main__':
+    unittest.main()